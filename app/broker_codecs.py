@@ -0,0 +1,225 @@
+"""
+Serialization codecs for MessageBroker payloads.
+
+Payloads are written as a versioned envelope:
+
+    b"\\x00" | version (1 byte) | codec id (1 byte) | compression id (1 byte) | body
+
+A leading zero byte never starts a JSON document or text, so readers can tell
+enveloped payloads from the plain JSON written by older releases and decode both.
+That lets API, bot and worker replicas of different versions share Redis while a
+rollout is in progress. The default "json" codec keeps writing the plain legacy
+format, so switching writers to another codec should happen once every reader
+understands it.
+"""
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:  # pragma: no cover
+    lz4 = None
+
+ENVELOPE_MARKER = b"\x00"
+ENVELOPE_VERSION = 1
+HEADER_SIZE = 4
+
+class Codec(ABC):
+    codec_id: int
+    name: str
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        ...
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        ...
+
+class JsonCodec(Codec):
+    codec_id = 0
+    name = "json"
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(bytes(data))
+
+class OrjsonCodec(Codec):
+    codec_id = 1
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError("The orjson codec requires the 'orjson' package")
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+class MsgpackCodec(Codec):
+    codec_id = 2
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError("The msgpack codec requires the 'msgpack' package")
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+class Compressor(ABC):
+    compression_id: int
+    name: str
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        ...
+
+class ZstdCompressor(Compressor):
+    compression_id = 1
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+class Lz4Compressor(Compressor):
+    compression_id = 2
+    name = "lz4"
+
+    def __init__(self):
+        if lz4 is None:
+            raise RuntimeError("lz4 compression requires the 'lz4' package")
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4.frame.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.frame.decompress(data)
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+COMPRESSORS = {compressor.name: compressor for compressor in (ZstdCompressor, Lz4Compressor)}
+
+class PayloadSerializer:
+    """Encodes payloads with the configured codec and decodes any known envelope or legacy JSON"""
+
+    def __init__(
+        self,
+        codec: str = "json",
+        compression: Optional[str] = None,
+        compression_threshold: int = 1024
+    ):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown broker codec: {codec}")
+        if compression and compression not in COMPRESSORS:
+            raise ValueError(f"Unknown broker compression: {compression}")
+
+        self.codec = CODECS[codec]()
+        self.compressor = COMPRESSORS[compression]() if compression else None
+        self.compression_threshold = compression_threshold
+        # Decoders are created on first use so that optional packages are only
+        # required when a peer actually sends that format
+        self._codecs: Dict[int, Codec] = {self.codec.codec_id: self.codec}
+        self._compressors: Dict[int, Compressor] = {}
+        if self.compressor:
+            self._compressors[self.compressor.compression_id] = self.compressor
+
+    @classmethod
+    def from_settings(cls) -> "PayloadSerializer":
+        from app.core.config import settings
+        return cls(
+            codec=settings.BROKER_CODEC,
+            compression=settings.BROKER_COMPRESSION,
+            compression_threshold=settings.BROKER_COMPRESSION_MIN_BYTES
+        )
+
+    def dumps(self, value: Any) -> bytes:
+        if isinstance(value, BaseModel):
+            value = value.model_dump(mode="json")
+        elif isinstance(value, bytes):
+            return value
+
+        if isinstance(self.codec, JsonCodec) and not self.compressor:
+            # Plain JSON is what readers without envelope support understand
+            return value.encode("utf-8") if isinstance(value, str) else self.codec.dumps(value)
+
+        body = self.codec.dumps(value)
+        compression_id = 0
+        if self.compressor and len(body) >= self.compression_threshold:
+            body = self.compressor.compress(body)
+            compression_id = self.compressor.compression_id
+        return ENVELOPE_MARKER + bytes((ENVELOPE_VERSION, self.codec.codec_id, compression_id)) + body
+
+    def loads(self, data: Any) -> Any:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        if not data.startswith(ENVELOPE_MARKER):
+            try:
+                return json.loads(data)
+            except ValueError:
+                return data.decode("utf-8", errors="replace")
+
+        version, codec_id, compression_id = data[1], data[2], data[3]
+        if version != ENVELOPE_VERSION:
+            raise ValueError(f"Unsupported payload envelope version: {version}")
+
+        body = memoryview(data)[HEADER_SIZE:]
+        if compression_id:
+            body = self._compressor(compression_id).decompress(body)
+        return self._codec(codec_id).loads(body)
+
+    def _codec(self, codec_id: int) -> Codec:
+        codec = self._codecs.get(codec_id)
+        if codec is None:
+            codec_class = next((c for c in CODECS.values() if c.codec_id == codec_id), None)
+            if codec_class is None:
+                raise ValueError(f"Unknown payload codec id: {codec_id}")
+            codec = self._codecs[codec_id] = codec_class()
+        return codec
+
+    def _compressor(self, compression_id: int) -> Compressor:
+        compressor = self._compressors.get(compression_id)
+        if compressor is None:
+            compressor_class = next((c for c in COMPRESSORS.values() if c.compression_id == compression_id), None)
+            if compressor_class is None:
+                raise ValueError(f"Unknown payload compression id: {compression_id}")
+            compressor = self._compressors[compression_id] = compressor_class()
+        return compressor
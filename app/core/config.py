@@ -1,22 +1,130 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
+
+class VLLMRoute(BaseModel):
+    """Model/backend pair and the requests it serves, routes are matched in order"""
+    name: str
+    model: str
+    base_url: str
+    min_prompt_tokens: int = 0
+    max_prompt_tokens: Optional[int] = None
+    roles: Optional[List[str]] = None  # any role if not set
+    fallback: Optional[str] = None  # route used while this one is saturated
+
+class GenerationProfile(BaseModel):
+    """Input limit and generation parameters for the requests of a user role"""
+    max_input_tokens: int = 2048
+    truncate_input: bool = False  # cut oversize messages instead of rejecting them
+    max_output_tokens: int = 512
+    temperature: float = 0.7
+    top_p: float = 0.95
+    stop: Optional[List[str]] = None
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    DATABASE_READ_URL: Optional[str] = None  # optional replica for read-only endpoints
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_PGBOUNCER_MODE: bool = False  # no client-side pooling or prepared statements behind PgBouncer
+    DB_READ_REPLICA_RETRY_INTERVAL: float = 30.0
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
 
     REDIS_URL: str
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: Optional[float] = 10.0  # seconds to wait for a free connection when the pool is full
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+    REDIS_SOCKET_TIMEOUT: Optional[float] = 5.0
+    REDIS_SOCKET_CONNECT_TIMEOUT: Optional[float] = 5.0
+    REDIS_RETRIES: int = 5
+    BROKER_WARMUP_CONNECTIONS: int = 2
+    BROKER_CODEC: str = "json"  # "json" (plain legacy format), "orjson" or "msgpack"
+    BROKER_COMPRESSION: Optional[str] = None  # "zstd" or "lz4"
+    BROKER_COMPRESSION_MIN_BYTES: int = 1024
 
     JWT_SECRET_KEY: str
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
     TELEGRAM_BOT_TOKEN: str
+    BOT_MODE: str = "polling"  # "polling" or "webhook"
+    TELEGRAM_WEBHOOK_URL: Optional[str] = None
+    TELEGRAM_WEBHOOK_PATH: str = "/telegram/webhook"
+    TELEGRAM_WEBHOOK_SECRET: Optional[str] = None
+    TELEGRAM_WEBHOOK_HOST: str = "0.0.0.0"
+    TELEGRAM_WEBHOOK_PORT: int = 8080
+    TELEGRAM_UPDATE_DEDUP_TTL: int = 86400
+    CHAT_DEBOUNCE_SECONDS: float = 1.0
+    CHAT_SUPERSEDE_QUEUED: bool = False  # newer messages replace queued ones instead of being coalesced
+
+    TELEGRAM_GLOBAL_RATE: float = 30.0  # messages per second across all chats
+    TELEGRAM_CHAT_RATE: float = 1.0  # messages per second in a private chat
+    TELEGRAM_CHAT_BURST: float = 3.0
+    TELEGRAM_GROUP_RATE_PER_MIN: float = 20.0
+    TELEGRAM_SEND_MAX_RETRIES: int = 5
+    BOT_METRICS_PORT: int = 8002
 
     VLLM_API_URL: str
     VLLM_MODEL_NAME: str = "default"
+    # JSON list of VLLMRoute, defaults to a single route to VLLM_API_URL/VLLM_MODEL_NAME
+    VLLM_ROUTES: List[VLLMRoute] = []
+    TOKENIZER_NAME: Optional[str] = None  # tokenizer.json path or Hugging Face model for token counts, needs `tokenizers`
+    TOKENIZER_REVISION: str = "main"  # pin to a commit hash when TOKENIZER_NAME is a Hugging Face model
+    # Hard cap on /message content, well above any profile's max_input_tokens in characters
+    MESSAGE_MAX_CHARS: int = 65536
+    # JSON object of GenerationProfile by user role, "default" applies to roles without one
+    GENERATION_PROFILES: Dict[str, GenerationProfile] = {
+        "default": GenerationProfile(),
+        "admin": GenerationProfile(max_input_tokens=8192, max_output_tokens=2048),
+    }
+    LLM_SYSTEM_PROMPT: str = "You are a helpful assistant."
+    # Token budget for system prompt, summary, history and the new message; 0 disables history
+    CONTEXT_MAX_TOKENS: int = 2048
+    CONTEXT_MAX_TURNS: int = 20
+    CONTEXT_SUMMARY_MAX_TOKENS: int = 256
+    CONTEXT_CACHE_TTL: int = 3600
+    LLM_REQUEST_TIMEOUT: float = 30.0  # per vLLM call
+    LLM_REQUEST_DEADLINE: float = 120.0  # total time budget for a message, including retries
+    LLM_MAX_ATTEMPTS: int = 4
+    LLM_RETRY_BASE_DELAY: float = 1.0
+    LLM_RETRY_MAX_DELAY: float = 20.0
+    LLM_RETRY_POLL_INTERVAL: float = 0.5
+    VLLM_CONCURRENCY_MIN: int = 1
+    VLLM_CONCURRENCY_MAX: int = 64
+    VLLM_CONCURRENCY_INITIAL: int = 8
+    VLLM_CONCURRENCY_BACKOFF: float = 0.9
+    VLLM_LATENCY_TOLERANCE: float = 1.5  # recent/baseline latency ratio that counts as overload
+    VLLM_WARMUP_PROMPT: str = "Hello"  # empty to skip the warm-up generation
+    VLLM_WARMUP_TIMEOUT: float = 120.0
+    WORKER_METRICS_PORT: int = 8003
+
+    LOOP_LAG_MONITOR_ENABLED: bool = False
+    LOOP_LAG_INTERVAL: float = 0.25
+    LOOP_LAG_THRESHOLD: float = 0.1
+    PROFILING_ENABLED: bool = False
+    PROFILING_HEADER: str = "X-Debug-Profile"
+    PROFILING_SECRET: Optional[str] = None
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_DIR: str = "profiles"
+
+    # List endpoints stream a chunked JSON array above this many rows
+    JSON_STREAM_THRESHOLD: int = 1000
+    JSON_STREAM_CHUNK_SIZE: int = 1000
+
+    USAGE_FLUSH_INTERVAL: float = 60.0  # seconds between roll-ups of the Redis usage counters
+    USAGE_FLUSH_BATCH_SIZE: int = 500
+
+    # Seconds a component may spend finishing in-flight work after SIGTERM
+    SHUTDOWN_DRAIN_TIMEOUT: float = 30.0
+
+    IDEMPOTENCY_TTL: int = 86400  # how long a finished request's result is kept
+    IDEMPOTENCY_LEASE_TTL: int = 30  # how long a running request holds its key without renewing it
+    IDEMPOTENCY_WAIT_TIMEOUT: float = 60.0  # how long a repeat waits for a running request, except /message
 
     SUBSCRIPTION_PRICE_RUB: float = 5.0
     SUBSCRIPTION_DURATION_MIN: int = 1
@@ -25,4 +133,7 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
 
+    def generation_profile(self, role: Optional[str]) -> GenerationProfile:
+        return self.GENERATION_PROFILES.get(role) or self.GENERATION_PROFILES.get("default") or GenerationProfile()
+
 settings = Settings() 
\ No newline at end of file
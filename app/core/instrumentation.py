@@ -0,0 +1,164 @@
+"""
+Opt-in instrumentation for finding blocking code in the API, worker and bot.
+
+LoopLagMonitor measures how late the event loop wakes up a sleeping task and logs
+the event loop thread's stack whenever the loop stays blocked longer than a
+threshold. ProfilingMiddleware profiles single API requests that carry a debug
+header, or a sampled fraction of all requests, and writes the profiles to disk.
+"""
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Optional
+
+from prometheus_client import Histogram
+
+try:
+    import pyinstrument
+except ImportError:  # pragma: no cover
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between the scheduled and actual wake-up of the lag probe",
+    ["component"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+class LoopLagMonitor:
+    def __init__(self, component: str, interval: float = 0.25, threshold: float = 0.1):
+        self.component = component
+        self.interval = interval
+        self.threshold = threshold
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._probe())
+        self._watchdog = threading.Thread(target=self._watch, name=f"{self.component}-loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info("Event loop lag monitor started for %s", self.component)
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled_at = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.labels(component=self.component).observe(max(0.0, loop.time() - scheduled_at))
+            self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        # Runs in its own thread, so it can see the loop while the loop is blocked
+        reported_heartbeat = None
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for < self.threshold or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            logger.warning(
+                "%s event loop blocked for at least %.3fs, current stack:\n%s",
+                self.component, blocked_for, stack
+            )
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles selected requests.
+
+    A request is profiled when it carries `header` with `secret` as its value or is
+    picked by `sample_rate`. Without a secret the header is ignored, so that clients
+    cannot make the API profile their requests. Only one request is profiled
+    at a time, since the profiler observes the whole event loop thread.
+    """
+
+    def __init__(self, app, output_dir: str, header: str, secret: Optional[str] = None, sample_rate: float = 0.0):
+        self.app = app
+        self.output_dir = output_dir
+        self.header = header.lower().encode("latin-1")
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self._lock = asyncio.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        if not secret:
+            logger.warning("No profiling secret is set, requests are only profiled by sampling")
+
+    def _should_profile(self, scope) -> bool:
+        for name, value in scope.get("headers", ()):
+            if name == self.header and self.secret:
+                return secrets.compare_digest(value, self.secret.encode("latin-1"))
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._lock.locked() or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        async with self._lock:
+            started_at = time.perf_counter()
+            # pyinstrument understands await points, cProfile is the stdlib fallback
+            if pyinstrument is not None:
+                profiler = pyinstrument.Profiler(async_mode="enabled")
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                if isinstance(profiler, cProfile.Profile):
+                    profiler.disable()
+                else:
+                    profiler.stop()
+                duration = time.perf_counter() - started_at
+                path = await asyncio.to_thread(self._write, profiler, scope)
+                logger.info("Profiled %s %s in %.3fs: %s", scope["method"], scope["path"], duration, path)
+
+    def _write(self, profiler, scope) -> str:
+        name = scope["path"].strip("/").replace("/", "_") or "root"
+        base = os.path.join(self.output_dir, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{scope['method']}-{name}")
+        if isinstance(profiler, cProfile.Profile):
+            path = base + ".prof"
+            profiler.dump_stats(path)
+        else:
+            path = base + ".html"
+            with open(path, "w", encoding="utf8") as f:
+                f.write(profiler.output_html())
+        return path
+
+def start_loop_lag_monitor(component: str) -> Optional[LoopLagMonitor]:
+    """Start a LoopLagMonitor on the running loop if enabled in settings"""
+    from app.core.config import settings
+    if not settings.LOOP_LAG_MONITOR_ENABLED:
+        return None
+    monitor = LoopLagMonitor(component, settings.LOOP_LAG_INTERVAL, settings.LOOP_LAG_THRESHOLD)
+    monitor.start()
+    return monitor
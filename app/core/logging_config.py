@@ -1,13 +1,93 @@
 import logging
 import sys
 import logging.config
+import logging.handlers
+import atexit
+import copy
+import json
 import os
+import queue
+import random
 from datetime import datetime
 
 LOGS_DIR = os.environ.get("LOGS_DIR", "logs")
+# "json" for structured output, "text" for the plain format
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Fraction of INFO and lower records kept per logger prefix, e.g. "app.tasks=0.1,app.telegram_bot=0.5"
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
 
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Render records as one JSON object per line, including any `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            "timestamp": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of INFO and lower records for the configured logger prefixes"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        # Longest prefix first so the most specific rule wins
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                return random.random() < rate
+        return True
+
+# Log arguments of these types cannot change before the listener thread formats them
+_IMMUTABLE_ARGS = (str, bytes, int, float, complex, bool, type(None), BaseException)
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread.
+
+    The stock handler merges args into the message before enqueueing, which puts
+    formatting cost back on the event loop. Records with mutable args, such as a
+    dict that is modified after the call, are still formatted right away so the
+    log shows their state at the time of the call.
+    """
+
+    def prepare(self, record):
+        args = record.args
+        if not args:
+            return record
+        if isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args):
+            return record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def parse_sample_rates(value: str) -> dict:
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+_CONSOLE_FORMATTER = "json" if LOG_FORMAT == "json" else "standard"
+_FILE_FORMATTER = "json" if LOG_FORMAT == "json" else "detailed"
+
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -20,18 +100,22 @@ LOGGING_CONFIG = {
             "format": "%(asctime)s [%(levelname)s] %(name)s:%(lineno)d: %(message)s",
             "datefmt": "%Y-%m-%d %H:%M:%S",
         },
+        "json": {
+            "()": JsonFormatter,
+            "datefmt": "%Y-%m-%dT%H:%M:%S%z",
+        },
     },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
             "level": "INFO",
-            "formatter": "standard",
+            "formatter": _CONSOLE_FORMATTER,
             "stream": "ext://sys.stdout",
         },
         "file": {
             "class": "logging.handlers.RotatingFileHandler",
             "level": "INFO",
-            "formatter": "detailed",
+            "formatter": _FILE_FORMATTER,
             "filename": os.path.join(LOGS_DIR, "llm_service.log"),
             "maxBytes": 10485760,  # 10MB
             "backupCount": 5,
@@ -40,7 +124,7 @@ LOGGING_CONFIG = {
         "error_file": {
             "class": "logging.handlers.RotatingFileHandler",
             "level": "ERROR",
-            "formatter": "detailed",
+            "formatter": _FILE_FORMATTER,
             "filename": os.path.join(LOGS_DIR, "llm_service_error.log"),
             "maxBytes": 10485760,  # 10MB
             "backupCount": 5,
@@ -81,8 +165,38 @@ LOGGING_CONFIG = {
     },
 }
 
+def setup_queue_logging(config: dict) -> list:
+    """
+    Move the configured handlers behind queues so that logging never blocks the event loop.
+
+    Loggers keep their handler sets, but each distinct set is served by one QueueListener
+    thread and the loggers only enqueue records. Returns the started listeners.
+    """
+    sampling_filter = SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES))
+    queue_handlers = {}
+    listeners = []
+    for name in config["loggers"]:
+        logger = logging.getLogger(name or None)
+        handlers = tuple(logger.handlers)
+        if not handlers:
+            continue
+        if handlers not in queue_handlers:
+            log_queue = queue.SimpleQueue()
+            queue_handler = LazyQueueHandler(log_queue)
+            queue_handler.addFilter(sampling_filter)
+            listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            listener.start()
+            listeners.append(listener)
+            queue_handlers[handlers] = queue_handler
+        logger.handlers = [queue_handlers[handlers]]
+
+    for listener in listeners:
+        atexit.register(listener.stop)
+    return listeners
+
 try:
     logging.config.dictConfig(LOGGING_CONFIG)
+    LOG_LISTENERS = setup_queue_logging(LOGGING_CONFIG)
 except Exception as e:
     print(f"Error configuring logging: {e}", file=sys.stderr)
     logging.basicConfig(
@@ -0,0 +1,63 @@
+from typing import Callable, Iterator, List, Union
+
+import orjson
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.engine import Result
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+def _encode_rows(rows: List) -> bytes:
+    return b",".join(orjson.dumps(dict(row)) for row in rows)
+
+def _stream_rows(db: Session, result: Result, head: List) -> Iterator[bytes]:
+    try:
+        yield b"[" + _encode_rows(head)
+        for rows in result.partitions():
+            yield b"," + _encode_rows(rows)
+        yield b"]"
+    finally:
+        db.close()
+
+def fetch_json_rows(
+    session_factory: Callable[[], Session],
+    statement: Select,
+    stream_threshold: int,
+    chunk_size: int
+) -> Union[bytes, Iterator[bytes]]:
+    """
+    Encode the rows of a column-only select as a JSON array of objects.
+
+    Results of up to `stream_threshold` rows come back encoded at once. Larger ones
+    come back as chunks that continue reading the same cursor, `chunk_size` rows at
+    a time, and close the session once exhausted.
+    """
+    db = session_factory()
+    try:
+        result = db.execute(statement.execution_options(yield_per=chunk_size)).mappings()
+        head = result.fetchmany(stream_threshold + 1)
+    except BaseException:
+        db.close()
+        raise
+
+    if len(head) > stream_threshold:
+        return _stream_rows(db, result, head)
+    db.close()
+    return b"[" + _encode_rows(head) + b"]"
+
+def json_rows_response(
+    session_factory: Callable[[], Session],
+    statement: Select,
+    stream_threshold: int,
+    chunk_size: int
+) -> Response:
+    """
+    JSON list response for a column-only select, bypassing ORM objects and Pydantic.
+
+    The rows are read through a session of their own, since the request's session
+    is closed before a streamed response body is sent.
+    """
+    body = fetch_json_rows(session_factory, statement, stream_threshold, chunk_size)
+    if isinstance(body, bytes):
+        return Response(body, media_type="application/json")
+    return StreamingResponse(body, media_type="application/json")
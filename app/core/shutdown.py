@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import signal
+import time
+from typing import Iterable, Optional, Set
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+SHUTDOWN_UNFINISHED = Counter(
+    "shutdown_unfinished_total",
+    "Work items that did not finish within the drain timeout on shutdown",
+    ["component"],
+)
+
+class GracefulShutdown:
+    """
+    SIGTERM/SIGINT handling for long-running components.
+
+    A signal sets `stopping` and starts the drain timeout. The component then stops
+    taking new work, waits for in-flight work with `drain` (all drains share the
+    same timeout), hands back whatever did not finish and closes its connections.
+    """
+
+    def __init__(self, component: str, timeout: float):
+        self.component = component
+        self.timeout = timeout
+        self.stopping = asyncio.Event()
+        self._deadline: Optional[float] = None
+
+    @classmethod
+    def from_settings(cls, component: str) -> "GracefulShutdown":
+        from app.core.config import settings
+        return cls(component, settings.SHUTDOWN_DRAIN_TIMEOUT)
+
+    def install(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.request_stop, sig.name)
+
+    def request_stop(self, reason: str = "requested"):
+        if self.stopping.is_set():
+            return
+        logger.info("%s shutting down (%s), draining for up to %ss", self.component, reason, self.timeout)
+        self._deadline = time.monotonic() + self.timeout
+        self.stopping.set()
+
+    async def wait(self):
+        await self.stopping.wait()
+
+    @property
+    def remaining(self) -> float:
+        """Seconds left of the drain timeout"""
+        if self._deadline is None:
+            return self.timeout
+        return max(0.0, self._deadline - time.monotonic())
+
+    async def drain(self, tasks: Iterable[asyncio.Task], what: str = "tasks") -> Set[asyncio.Task]:
+        """Wait for tasks until the drain timeout, returns the ones still running"""
+        tasks = set(tasks)
+        if not tasks:
+            return set()
+        logger.info("%s waiting for %d in-flight %s", self.component, len(tasks), what)
+        _, pending = await asyncio.wait(tasks, timeout=self.remaining)
+        if pending:
+            SHUTDOWN_UNFINISHED.labels(component=self.component).inc(len(pending))
+            logger.warning("%s: %d %s did not finish within the drain timeout", self.component, len(pending), what)
+        return pending
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from openai import AsyncOpenAI
+from prometheus_client import Gauge
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PHASE_SECONDS = Gauge(
+    "startup_phase_seconds",
+    "Duration of each startup phase",
+    ["component", "phase"],
+)
+SERVICE_READY = Gauge(
+    "service_ready",
+    "1 once the component finished its startup phases",
+    ["component"],
+)
+
+class StartupTracker:
+    """Times startup phases and records when a component becomes ready"""
+
+    def __init__(self, component: str):
+        self.component = component
+        self.ready = False
+        self.started_at = time.monotonic()
+        SERVICE_READY.labels(component=component).set(0)
+
+    @asynccontextmanager
+    async def phase(self, name: str):
+        started_at = time.monotonic()
+        logger.info("%s startup: %s...", self.component, name)
+        try:
+            yield
+        except Exception:
+            logger.error("%s startup: %s failed after %.2fs", self.component, name, time.monotonic() - started_at)
+            raise
+        duration = time.monotonic() - started_at
+        STARTUP_PHASE_SECONDS.labels(component=self.component, phase=name).set(duration)
+        logger.info("%s startup: %s done in %.2fs", self.component, name, duration)
+
+    def mark_ready(self):
+        self.ready = True
+        SERVICE_READY.labels(component=self.component).set(1)
+        STARTUP_PHASE_SECONDS.labels(component=self.component, phase="total").set(time.monotonic() - self.started_at)
+        logger.info("%s is ready after %.2fs", self.component, time.monotonic() - self.started_at)
+
+    def mark_not_ready(self):
+        self.ready = False
+        SERVICE_READY.labels(component=self.component).set(0)
+
+def prefill_db_pool(engine: Engine, size: Optional[int] = None):
+    """Open `size` connections (the pool size by default) and return them to the pool"""
+    if size is None:
+        size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    connections = []
+    try:
+        for _ in range(size):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+
+async def warm_up_vllm(base_url: str, model: str, prompt: str, max_tokens: int = 8, timeout: float = 120.0):
+    """
+    Send one short generation so that the first user does not pay for vLLM's cold start.
+
+    Retries until `timeout`, since vLLM may still be loading the model when we start.
+    Failures are logged but do not prevent startup.
+    """
+    # Retries are ours, so that no attempt runs past the deadline
+    client = AsyncOpenAI(base_url=base_url, api_key="not-needed", max_retries=0)
+    deadline = time.monotonic() + timeout
+    delay = 1.0
+    try:
+        while True:
+            try:
+                await client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=max_tokens,
+                    timeout=max(deadline - time.monotonic(), 0.1)
+                )
+                return
+            except Exception as e:
+                if time.monotonic() + delay > deadline:
+                    logger.warning("vLLM warm-up against %s failed: %s", base_url, e)
+                    return
+                logger.info("vLLM at %s is not ready yet (%s), retrying in %.0fs", base_url, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10.0)
+    finally:
+        await client.close()
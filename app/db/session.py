@@ -1,13 +1,111 @@
+import logging
+import time
+from typing import Optional
+
+from prometheus_client import Gauge, Histogram
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
 from app.core.config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+logger = logging.getLogger(__name__)
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the SQLAlchemy pool",
+    ["pool"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Connections in the SQLAlchemy pool",
+    ["pool", "state"],
+)
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(pool=self.logging_name).observe(time.perf_counter() - started_at)
+
+def _engine_kwargs(url: str) -> dict:
+    if settings.DB_PGBOUNCER_MODE:
+        # PgBouncer in transaction mode does the pooling and may hand each transaction
+        # to a different server connection, so keep no client-side pool and never
+        # rely on server-side prepared statements
+        connect_args = {}
+        driver = make_url(url).get_driver_name()
+        if driver == "asyncpg":
+            connect_args = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+        elif driver == "psycopg":
+            connect_args = {"prepare_threshold": None}
+        return {"poolclass": NullPool, "connect_args": connect_args}
+
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+def create_db_engine(url: str, name: str) -> Engine:
+    db_engine = create_engine(url, pool_logging_name=name, **_engine_kwargs(url))
+    if isinstance(db_engine.pool, QueuePool):
+        DB_POOL_CONNECTIONS.labels(pool=name, state="checked_out").set_function(lambda: db_engine.pool.checkedout())
+        DB_POOL_CONNECTIONS.labels(pool=name, state="idle").set_function(lambda: db_engine.pool.checkedin())
+    return db_engine
+
+engine = create_db_engine(settings.DATABASE_URL, "primary")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+read_engine: Optional[Engine] = None
+ReadSessionLocal: Optional[sessionmaker] = None
+if settings.DATABASE_READ_URL:
+    read_engine = create_db_engine(settings.DATABASE_READ_URL, "replica")
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# The replica is skipped until this monotonic time after it failed to connect
+_replica_unhealthy_until = 0.0
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+def open_read_session() -> Session:
+    """Session on the replica while it is reachable, on the primary otherwise"""
+    global _replica_unhealthy_until
+
+    db = None
+    if ReadSessionLocal is not None and time.monotonic() >= _replica_unhealthy_until:
+        db = ReadSessionLocal()
+        try:
+            # Check out the connection now so an unreachable replica falls back to the primary
+            db.connection()
+        except OperationalError as e:
+            logger.warning("Read replica unavailable, using the primary for %ss: %s", settings.DB_READ_REPLICA_RETRY_INTERVAL, e)
+            _replica_unhealthy_until = time.monotonic() + settings.DB_READ_REPLICA_RETRY_INTERVAL
+            db.close()
+            db = None
+
+    if db is None:
+        db = SessionLocal()
+    return db
+
+def get_read_db():
+    """Session for read-only endpoints, served by the replica while it is reachable"""
+    db = open_read_session()
+    try:
+        yield db
+    finally:
+        db.close()
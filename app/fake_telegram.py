@@ -0,0 +1,66 @@
+"""
+Local fake Telegram sender for exercising the bot's webhook mode.
+
+Posts hand-built updates to the webhook endpoint the same way Telegram does,
+including redeliveries of the same update_id, e.g.:
+
+    python -m app.fake_telegram --url http://localhost:8080/telegram/webhook --secret s3cret --count 3 --repeat 2
+"""
+import argparse
+import asyncio
+import time
+from typing import List, Optional
+
+import httpx
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def build_update(update_id: int, chat_id: int, text: str) -> dict:
+    """Build a minimal private-chat text message update"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Fake"},
+            "text": text,
+        },
+    }
+
+async def send_updates(
+    url: str,
+    updates: List[dict],
+    secret: Optional[str] = None,
+    repeat: int = 1
+) -> List[int]:
+    """Deliver every update `repeat` times, returns the HTTP status of each delivery"""
+    headers = {SECRET_HEADER: secret} if secret else {}
+    statuses = []
+    async with httpx.AsyncClient() as client:
+        for update in updates:
+            for _ in range(repeat):
+                response = await client.post(url, json=update, headers=headers)
+                statuses.append(response.status_code)
+    return statuses
+
+async def main():
+    parser = argparse.ArgumentParser(description="Send fake Telegram updates to a webhook")
+    parser.add_argument("--url", default="http://localhost:8080/telegram/webhook")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--chat-id", type=int, default=1)
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1, help="deliveries per update_id")
+    parser.add_argument("--first-update-id", type=int, default=int(time.time()))
+    parser.add_argument("--text", default="Hello")
+    args = parser.parse_args()
+
+    updates = [
+        build_update(args.first_update_id + i, args.chat_id, f"{args.text} #{i}")
+        for i in range(args.count)
+    ]
+    statuses = await send_updates(args.url, updates, secret=args.secret, repeat=args.repeat)
+    print(f"Delivered {len(statuses)} requests, statuses: {statuses}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
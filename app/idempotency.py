@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+from app.message_broker import MessageBroker
+
+logger = logging.getLogger(__name__)
+
+IN_PROGRESS = "in_progress"
+DONE = "done"
+
+def request_hash(payload: Any) -> str:
+    """Stable hash of a request body, so that a key reused for another request can be told apart"""
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump(mode="json")
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+class IdempotencyStore:
+    """
+    Runs a request at most once per Idempotency-Key.
+
+    The first request with a key claims it in Redis and stores its result when it
+    finishes. Repeats of a finished request get the stored result back, and repeats
+    that arrive while the first one is still running wait for its result instead of
+    doing the work again. Failed requests release the key so that they can be retried.
+
+    A running request holds the key with a short lease that it keeps refreshing, so
+    the key frees up soon after a crashed process instead of after the full TTL.
+    Reusing a key with a different request body is rejected.
+    """
+
+    def __init__(self, broker: MessageBroker, ttl: int, wait_timeout: float, lease_ttl: int = 30):
+        self.broker = broker
+        self.notifications = broker.listener("idempotency:*:done")
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.lease_ttl = lease_ttl
+
+    async def run(
+        self,
+        scope: str,
+        key: Optional[str],
+        func: Callable[[], Awaitable[Any]],
+        payload: Any = None,
+        wait_timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Run func once for scope and key. Repeats wait up to `wait_timeout` seconds
+        (the store's default if None) for the running request before getting 409.
+        """
+        if not key:
+            return await func()
+
+        record_key = f"idempotency:{scope}:{key}"
+        payload_hash = request_hash(payload)
+        while True:
+            claim = {"status": IN_PROGRESS, "request_hash": payload_hash}
+            if await self.broker.set_nx(record_key, claim, expire=self.lease_ttl):
+                return await self._execute(record_key, payload_hash, func)
+
+            logger.info("Repeated request for idempotency key %s", record_key)
+            record = await self._wait_for_result(record_key, payload_hash, wait_timeout or self.wait_timeout)
+            if record is not None:
+                return record["result"]
+            # The original request failed or its lease expired, so this one takes over
+
+    async def _execute(self, record_key: str, payload_hash: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        lease = asyncio.create_task(self._renew_lease(record_key))
+        try:
+            result = await func()
+        except BaseException:
+            await self.broker.delete(record_key)
+            await self.broker.publish(f"{record_key}:done", {"status": "failed"})
+            raise
+        finally:
+            lease.cancel()
+
+        if isinstance(result, BaseModel):
+            result = result.model_dump(mode="json")
+        await self.broker.set(
+            record_key,
+            {"status": DONE, "request_hash": payload_hash, "result": result},
+            expire=self.ttl
+        )
+        await self.broker.publish(f"{record_key}:done", {"status": DONE})
+        return result
+
+    async def _renew_lease(self, record_key: str):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self.broker.expire(record_key, self.lease_ttl)
+            except Exception as e:
+                logger.warning("Could not renew the lease of idempotency key %s: %s", record_key, e)
+
+    def _check_payload(self, record: dict, payload_hash: str):
+        # Records written before request hashes were stored carry none
+        if record.get("request_hash", payload_hash) != payload_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="This Idempotency-Key was already used for a different request"
+            )
+
+    async def _wait_for_result(self, record_key: str, payload_hash: str, wait_timeout: float) -> Optional[dict]:
+        """Wait for the finished record, returns None if the original request released the key"""
+        deadline = time.monotonic() + wait_timeout
+        async with self.notifications.expect(f"{record_key}:done") as notifications:
+            while time.monotonic() < deadline:
+                # Checked after subscribing so a result stored in between is not missed
+                record = await self.broker.get(record_key)
+                if record is None:
+                    return None
+                self._check_payload(record, payload_hash)
+                if record["status"] == DONE:
+                    return record
+
+                try:
+                    await asyncio.wait_for(notifications.get(), min(1.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still in progress"
+        )
@@ -1,27 +1,90 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, BackgroundTasks, Depends, Header, HTTPException, status
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta, UTC
-from typing import List
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, UTC
+from typing import List, Optional
 from pydantic import BaseModel
 from prometheus_fastapi_instrumentator import Instrumentator
+import asyncio
 
-from app.db.session import get_db
+from app.db.session import SessionLocal, engine, get_db, get_read_db, open_read_session, read_engine
 from app.models import models
 from app.schemas import user, subscription, message
 from app.core.config import settings
+from app.core.instrumentation import ProfilingMiddleware, start_loop_lag_monitor
+from app.core.responses import json_rows_response
+from app.core.startup import StartupTracker, prefill_db_pool
+from app.idempotency import IdempotencyStore
 from app.tasks import process_llm_request
+from app.tasks.process_llm import PROCESSING_RESPONSE, message_broker, response_listener, retry_queue
+from app.tasks.tokens import estimate_tokens, load_tokenizer, truncate_to_tokens
 from jose import JWTError, jwt
 
-app = FastAPI(title="LLM Service API")
+startup = StartupTracker("api")
+idempotency = IdempotencyStore(
+    message_broker,
+    ttl=settings.IDEMPOTENCY_TTL,
+    wait_timeout=settings.IDEMPOTENCY_WAIT_TIMEOUT,
+    lease_ttl=settings.IDEMPOTENCY_LEASE_TTL
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_lag_monitor = start_loop_lag_monitor("api")
+    async with startup.phase("db_pool"):
+        await asyncio.to_thread(prefill_db_pool, engine)
+    async with startup.phase("broker"):
+        await message_broker.warm_up(settings.BROKER_WARMUP_CONNECTIONS)
+    async with startup.phase("tokenizer"):
+        await asyncio.to_thread(load_tokenizer)
+    async with startup.phase("response_listeners"):
+        await response_listener.start()
+        await idempotency.notifications.start()
+    startup.mark_ready()
+    yield
+    # Uvicorn has stopped accepting connections and waited for in-flight requests
+    startup.mark_not_ready()
+    await message_broker.disconnect()
+    engine.dispose()
+    if read_engine is not None:
+        read_engine.dispose()
+    if loop_lag_monitor:
+        await loop_lag_monitor.stop()
+
+app = FastAPI(title="LLM Service API", lifespan=lifespan)
 
 Instrumentator().instrument(app).expose(app)
 
+if settings.PROFILING_ENABLED:
+    app.add_middleware(
+        ProfilingMiddleware,
+        output_dir=settings.PROFILING_DIR,
+        header=settings.PROFILING_HEADER,
+        secret=settings.PROFILING_SECRET,
+        sample_rate=settings.PROFILING_SAMPLE_RATE
+    )
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 class TokenRequest(BaseModel):
     telegram_id: str
 
+@app.get("/live")
+async def liveness():
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def readiness():
+    if not startup.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "starting"})
+    if not (response_listener.running and idempotency.notifications.running):
+        # Replies would never reach their waiters, the next request restarts the listeners
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "listener_down"})
+    return {"status": "ready"}
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(UTC) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -45,7 +108,7 @@ async def get_token(token_request: TokenRequest, db: Session = Depends(get_db)):
     access_token = create_access_token({"sub": token_request.telegram_id})
     return {"access_token": access_token, "token_type": "bearer"}
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def authenticate_user(token: str, db: Session) -> models.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -64,12 +127,41 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         raise credentials_exception
     return user
 
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return authenticate_user(token, db)
+
+async def get_current_user_readonly(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
+    """Same as get_current_user, but loaded from the read replica for endpoints that never write"""
+    try:
+        return authenticate_user(token, db)
+    except HTTPException:
+        if db.get_bind() is engine:
+            raise
+    # A user just created by /token may not have reached the replica yet. Only
+    # column attributes are used, so the user stays usable after its session closes.
+    primary = SessionLocal()
+    try:
+        return authenticate_user(token, primary)
+    finally:
+        primary.close()
+
 @app.post("/message", response_model=message.MessageResponse)
 async def create_message(
     message_in: message.MessageCreate,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
+    return await idempotency.run(
+        f"message:{current_user.id}",
+        idempotency_key,
+        lambda: _create_message(message_in, current_user, db),
+        payload=message_in,
+        # A message may wait for its answer until the deadline plus the final attempt
+        wait_timeout=settings.LLM_REQUEST_DEADLINE + settings.LLM_REQUEST_TIMEOUT
+    )
+
+async def _create_message(message_in: message.MessageCreate, current_user: models.User, db: Session):
     active_subscription = db.query(models.Subscription).filter(
         models.Subscription.user_id == current_user.id,
         models.Subscription.end_date > datetime.now(UTC)
@@ -81,10 +173,21 @@ async def create_message(
             detail="Active subscription required"
         )
 
+    # Oversize prompts are refused here instead of tying up a vLLM slot
+    content = message_in.content
+    profile = settings.generation_profile(current_user.role.value)
+    if estimate_tokens(content) > profile.max_input_tokens:
+        if not profile.truncate_input:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Message is too long, the limit is {profile.max_input_tokens} tokens"
+            )
+        content = truncate_to_tokens(content, profile.max_input_tokens)
+
     db_message = models.Message(
         user_id=current_user.id,
-        content=message_in.content,
-        response="Processing..."
+        content=content,
+        response=PROCESSING_RESPONSE
     )
 
     db.add(db_message)
@@ -96,21 +199,49 @@ async def create_message(
 
     return message.MessageResponse(response=db_message.response)
 
+# Columns of message.Message and user.User, selected directly for the list endpoints
+MESSAGE_COLUMNS = (
+    models.Message.content,
+    models.Message.id,
+    models.Message.user_id,
+    models.Message.response,
+    models.Message.created_at,
+    models.Message.updated_at,
+)
+USER_COLUMNS = (
+    models.User.telegram_id,
+    models.User.role,
+    models.User.id,
+    models.User.wallet,
+    models.User.created_at,
+    models.User.updated_at,
+)
+
 @app.get("/history", response_model=List[message.Message])
-async def get_message_history(
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    messages = db.query(models.Message).filter(
+async def get_message_history(current_user: models.User = Depends(get_current_user_readonly)):
+    statement = select(*MESSAGE_COLUMNS).where(
         models.Message.user_id == current_user.id
-    ).order_by(models.Message.created_at.desc()).all()
-    return messages
+    ).order_by(models.Message.created_at.desc())
+    return json_rows_response(
+        open_read_session,
+        statement,
+        stream_threshold=settings.JSON_STREAM_THRESHOLD,
+        chunk_size=settings.JSON_STREAM_CHUNK_SIZE
+    )
 
 @app.post("/subscribe")
 async def create_subscription(
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
+    return await idempotency.run(
+        f"subscribe:{current_user.id}",
+        idempotency_key,
+        lambda: _create_subscription(current_user, db)
+    )
+
+async def _create_subscription(current_user: models.User, db: Session):
     active_subscription = db.query(models.Subscription).filter(
         models.Subscription.user_id == current_user.id,
         models.Subscription.end_date > datetime.now(UTC)
@@ -154,22 +285,46 @@ async def create_subscription(
     return {"message": "Subscription created successfully", "coins_spent": subscription_cost, "remaining_coins": current_user.wallet}
 
 @app.get("/wallet", response_model=dict)
-async def get_wallet_balance(current_user: models.User = Depends(get_current_user)):
+async def get_wallet_balance(current_user: models.User = Depends(get_current_user_readonly)):
     return {
         "balance": current_user.wallet,
         "subscription_cost_per_minute": 10
     }
 
-@app.get("/me", response_model=user.User)
-async def get_user_info(current_user: models.User = Depends(get_current_user)):
-    return current_user
+def usage_totals_query(db: Session):
+    """Usage summed from the daily aggregates, never from the messages table"""
+    return db.query(
+        func.coalesce(func.sum(models.Usage.requests), 0).label("requests"),
+        func.coalesce(func.sum(models.Usage.prompt_tokens), 0).label("prompt_tokens"),
+        func.coalesce(func.sum(models.Usage.completion_tokens), 0).label("completion_tokens")
+    )
+
+@app.get("/me", response_model=user.UserInfo)
+async def get_user_info(
+    current_user: models.User = Depends(get_current_user_readonly),
+    db: Session = Depends(get_read_db)
+):
+    totals = usage_totals_query(db).filter(models.Usage.user_id == current_user.id).one()
+    return user.UserInfo(
+        **user.User.model_validate(current_user).model_dump(),
+        usage=user.UsageTotals(**totals._asdict())
+    )
 
 @app.post("/add_coins")
 async def add_coins(
     coins_request: user.AddCoinsRequest,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
+    return await idempotency.run(
+        f"add_coins:{current_user.id}",
+        idempotency_key,
+        lambda: _add_coins(coins_request, current_user, db),
+        payload=coins_request
+    )
+
+async def _add_coins(coins_request: user.AddCoinsRequest, current_user: models.User, db: Session):
     current_user.wallet += coins_request.amount
     
     transaction = models.Transaction(
@@ -183,17 +338,49 @@ async def add_coins(
     return {"message": f"{coins_request.amount} coins added successfully", "new_balance": current_user.wallet}
 
 @app.get("/admin/users", response_model=List[user.User])
-async def list_users(
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def list_users(current_user: models.User = Depends(get_current_user_readonly)):
+    if current_user.role != models.UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    statement = select(*USER_COLUMNS).order_by(models.User.id)
+    return json_rows_response(
+        open_read_session,
+        statement,
+        stream_threshold=settings.JSON_STREAM_THRESHOLD,
+        chunk_size=settings.JSON_STREAM_CHUNK_SIZE
+    )
+
+@app.get("/admin/usage", response_model=List[user.UserUsage])
+async def list_usage(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    user_id: Optional[int] = None,
+    current_user: models.User = Depends(get_current_user_readonly),
+    db: Session = Depends(get_read_db)
 ):
     if current_user.role != models.UserRole.ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
         )
-    users = db.query(models.User).all()
-    return users
+
+    query = usage_totals_query(db).add_columns(
+        models.Usage.user_id,
+        func.min(models.Usage.period).label("first_period"),
+        func.max(models.Usage.period).label("last_period")
+    )
+    if since:
+        query = query.filter(models.Usage.period >= since)
+    if until:
+        query = query.filter(models.Usage.period <= until)
+    if user_id is not None:
+        query = query.filter(models.Usage.user_id == user_id)
+    rows = query.group_by(models.Usage.user_id).order_by(
+        (func.sum(models.Usage.prompt_tokens) + func.sum(models.Usage.completion_tokens)).desc()
+    ).all()
+    return [user.UserUsage(**row._asdict()) for row in rows]
 
 @app.post("/admin/subscribe/{user_id}")
 async def admin_subscribe_user(
@@ -225,4 +412,36 @@ async def admin_subscribe_user(
     db.add(subscription)
     db.commit()
     
-    return {"message": f"Subscription created for user {user_id}"} 
\ No newline at end of file
+    return {"message": f"Subscription created for user {user_id}"} 
+
+@app.get("/admin/dead_letters")
+async def list_dead_letters(current_user: models.User = Depends(get_current_user_readonly)):
+    if current_user.role != models.UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return await retry_queue.list_dead_letters()
+
+@app.post("/admin/dead_letters/{message_id}/replay")
+async def replay_dead_letter(
+    message_id: int,
+    background_tasks: BackgroundTasks,
+    current_user: models.User = Depends(get_current_user)
+):
+    if current_user.role != models.UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+
+    entry = await retry_queue.take_dead_letter(message_id)
+    if not entry:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dead letter not found"
+        )
+
+    # Runs the whole pipeline again and stores the new response on the message
+    background_tasks.add_task(process_llm_request, message_id)
+    return {"message": f"Replaying message {message_id}"}
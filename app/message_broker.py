@@ -1,30 +1,256 @@
-from typing import Any, Optional
-import json
-from redis.asyncio import Redis, from_url
-from pydantic import BaseModel
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from prometheus_client import Gauge
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.retry import Retry
+from redis.backoff import DecorrelatedJitterBackoff
+from redis.exceptions import ConnectionError, TimeoutError, WatchError
+
+from app.broker_codecs import PayloadSerializer
+
+logger = logging.getLogger(__name__)
+
+REDIS_POOL_CONNECTIONS = Gauge(
+    "redis_pool_connections",
+    "Connections in the MessageBroker Redis pool",
+    ["broker", "state"],
+)
+
+class MeteredConnectionPool(BlockingConnectionPool):
+    """Connection pool that counts the connections it created and lent out"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_connections = 0
+        self._lent: Set = set()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        self.created_connections += 1
+        return connection
+
+    @property
+    def in_use_connections(self) -> int:
+        return len(self._lent)
+
+    async def get_connection(self, *args, **kwargs):
+        connection = await super().get_connection(*args, **kwargs)
+        self._lent.add(connection)
+        return connection
+
+    async def release(self, connection):
+        # The base pool also releases connections that failed their health check
+        # before they were handed out, so only lent connections are uncounted
+        self._lent.discard(connection)
+        await super().release(connection)
+
+class ResponseListener:
+    """
+    Delivers messages published to per-request channels over one shared connection.
+
+    A pattern subscription receives the messages of every matching channel and
+    hands each to the waiters registered for its channel, so a request waiting for
+    its reply does not hold a pooled connection of its own. Messages nobody waits
+    for are dropped, which makes registering before publishing the request a must.
+    """
+
+    def __init__(self, broker: "MessageBroker", *patterns: str):
+        self.broker = broker
+        self.patterns = patterns
+        self._waiters: Dict[str, Set[asyncio.Queue]] = {}
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        async with self._lock:
+            if self.running:
+                return
+            if self._task is not None:
+                # The previous loop died, its pubsub is replaced along with it
+                self._log_task_exit(self._task)
+                self._task = None
+                await self._pubsub.aclose()
+            if not self.broker.redis:
+                await self.broker.connect()
+            self._pubsub = self.broker.redis.pubsub()
+            await self._pubsub.psubscribe(*self.patterns)
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # A pending pubsub read does not always give way to cancellation, so the
+            # loop is asked to stop instead and exits after its current read
+            self._stopping.set()
+            await asyncio.wait([self._task])
+            self._log_task_exit(self._task)
+            self._task = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    @asynccontextmanager
+    async def expect(self, channel: str) -> AsyncIterator[asyncio.Queue]:
+        """Queue of the messages published to channel while the context is open"""
+        await self.start()
+        queue = asyncio.Queue()
+        self._waiters.setdefault(channel, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            waiters = self._waiters[channel]
+            waiters.discard(queue)
+            if not waiters:
+                del self._waiters[channel]
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                # The pubsub reconnects and subscribes again on its own after connection errors
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                logger.warning("Response listener for %s failed to read: %s", self.patterns, e)
+                await asyncio.sleep(1.0)
+                continue
+
+            if not message or message["type"] != "pmessage":
+                continue
+            try:
+                self._deliver(message)
+            except Exception as e:
+                # One bad payload must not stop replies to everyone else
+                logger.error("Response listener dropped a message on %s: %s", message["channel"], e)
+
+    def _deliver(self, message: dict):
+        waiters = self._waiters.get(message["channel"].decode("utf-8"))
+        if waiters:
+            payload = self.broker.serializer.loads(message["data"])
+            for queue in waiters:
+                queue.put_nowait(payload)
+
+    def _log_task_exit(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Response listener for %s stopped: %s", self.patterns, task.exception())
 
 class MessageBroker:
-    def __init__(self, redis_url: str = "redis://localhost:6379"):
+    def __init__(
+        self,
+        redis_url: str = "redis://localhost:6379",
+        serializer: Optional[PayloadSerializer] = None,
+        name: str = "default",
+        max_connections: int = 50,
+        pool_timeout: Optional[float] = 10.0,
+        health_check_interval: int = 30,
+        socket_timeout: Optional[float] = 5.0,
+        socket_connect_timeout: Optional[float] = 5.0,
+        retries: int = 5,
+        backoff_base: float = 0.1,
+        backoff_cap: float = 5.0
+    ):
         self.redis_url = redis_url
         self.redis: Optional[Redis] = None
+        self.serializer = serializer or PayloadSerializer.from_settings()
+        self.name = name
+        self.max_connections = max_connections
+        self.pool_timeout = pool_timeout
+        self.health_check_interval = health_check_interval
+        self.socket_timeout = socket_timeout
+        self.socket_connect_timeout = socket_connect_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.pool: Optional[MeteredConnectionPool] = None
+        self._listeners: List[ResponseListener] = []
+
+    @classmethod
+    def from_settings(cls, name: str = "default") -> "MessageBroker":
+        from app.core.config import settings
+        return cls(
+            redis_url=settings.REDIS_URL,
+            name=name,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            pool_timeout=settings.REDIS_POOL_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            retries=settings.REDIS_RETRIES
+        )
 
     async def connect(self):
-        self.redis = await from_url(self.redis_url, encoding="utf-8", decode_responses=True)
+        # Commands that fail on a broken connection are retried on a fresh one
+        # with jittered exponential backoff
+        retry = Retry(DecorrelatedJitterBackoff(cap=self.backoff_cap, base=self.backoff_base), self.retries)
+        # Payloads are binary envelopes, so responses are kept as raw bytes. A full
+        # pool makes callers wait up to pool_timeout for a connection instead of failing.
+        self.pool = MeteredConnectionPool.from_url(
+            self.redis_url,
+            max_connections=self.max_connections,
+            timeout=self.pool_timeout,
+            health_check_interval=self.health_check_interval,
+            socket_timeout=self.socket_timeout,
+            socket_connect_timeout=self.socket_connect_timeout,
+            socket_keepalive=True,
+            retry=retry,
+            retry_on_error=[ConnectionError, TimeoutError],
+            decode_responses=False
+        )
+        self.redis = Redis(connection_pool=self.pool)
+        self._register_pool_metrics()
+
+    async def warm_up(self, connections: int = 1):
+        """Establish `connections` pooled connections up front instead of on first use"""
+        if not self.redis:
+            await self.connect()
+
+        await asyncio.gather(*(self.redis.ping() for _ in range(connections)))
+
+    def listener(self, *patterns: str) -> ResponseListener:
+        """Shared listener for the channels matching patterns, started on first use and stopped on disconnect"""
+        listener = ResponseListener(self, *patterns)
+        self._listeners.append(listener)
+        return listener
 
     async def disconnect(self):
+        for listener in self._listeners:
+            await listener.stop()
         if self.redis:
             await self.redis.close()
+        if self.pool:
+            await self.pool.disconnect()
+
+    def _register_pool_metrics(self):
+        pool = self.pool
+        REDIS_POOL_CONNECTIONS.labels(broker=self.name, state="max").set(self.max_connections)
+        REDIS_POOL_CONNECTIONS.labels(broker=self.name, state="in_use").set_function(
+            lambda: pool.in_use_connections
+        )
+        REDIS_POOL_CONNECTIONS.labels(broker=self.name, state="idle").set_function(
+            lambda: pool.created_connections - pool.in_use_connections
+        )
 
     async def publish(self, channel: str, message: Any):
         if not self.redis:
             await self.connect()
         
-        if isinstance(message, (dict, list)):
-            message = json.dumps(message)
-        elif isinstance(message, BaseModel):
-            message = message.model_dump_json()
-        
-        await self.redis.publish(channel, message)
+        await self.redis.publish(channel, self.serializer.dumps(message))
+
+    async def publish_many(self, messages: Iterable[Tuple[str, Any]]):
+        """Publish (channel, message) pairs in a single round-trip"""
+        if not self.redis:
+            await self.connect()
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for channel, message in messages:
+                pipe.publish(channel, self.serializer.dumps(message))
+            await pipe.execute()
 
     async def subscribe(self, channel: str):
         if not self.redis:
@@ -34,27 +260,67 @@ class MessageBroker:
         await pubsub.subscribe(channel)
         return pubsub
 
-    async def get_message(self, pubsub) -> Optional[dict]:
-        message = await pubsub.get_message(ignore_subscribe_messages=True)
+    async def get_message(self, pubsub, timeout: float = 0.0) -> Optional[Any]:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
         if message and message["type"] == "message":
-            try:
-                return json.loads(message["data"])
-            except json.JSONDecodeError:
-                return message["data"]
+            return self.serializer.loads(message["data"])
         return None
 
     async def set(self, key: str, value: Any, expire: Optional[int] = None):
         if not self.redis:
             await self.connect()
         
-        if isinstance(value, (dict, list)):
-            value = json.dumps(value)
-        elif isinstance(value, BaseModel):
-            value = value.model_dump_json()
-        
-        await self.redis.set(key, value)
-        if expire:
-            await self.redis.expire(key, expire)
+        await self.redis.set(key, self.serializer.dumps(value), ex=expire)
+
+    async def set_nx(self, key: str, value: Any, expire: Optional[int] = None) -> bool:
+        """Set key only if it does not exist yet, returns True when the key was set"""
+        if not self.redis:
+            await self.connect()
+
+        return bool(await self.redis.set(key, self.serializer.dumps(value), nx=True, ex=expire))
+
+    async def mset(self, mapping: Dict[str, Any], expire: Optional[int] = None):
+        """Set several keys in a single round-trip, each with the same TTL"""
+        if not self.redis:
+            await self.connect()
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in mapping.items():
+                pipe.set(key, self.serializer.dumps(value), ex=expire)
+            await pipe.execute()
+
+    async def update(
+        self,
+        key: str,
+        func: Callable[[Optional[Any]], Optional[Any]],
+        expire: Optional[int] = None
+    ) -> Optional[Any]:
+        """
+        Replace the value of key with func(current value) atomically, returns the resulting value.
+
+        The key is watched while func runs and the update starts over if another
+        client changed it in the meantime, so func may be called more than once.
+        When func returns None the key is left as it is.
+        """
+        if not self.redis:
+            await self.connect()
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    value = await pipe.get(key)
+                    current = self.serializer.loads(value) if value else None
+                    new = func(current)
+                    if new is None:
+                        await pipe.unwatch()
+                        return current
+                    pipe.multi()
+                    pipe.set(key, self.serializer.dumps(new), ex=expire)
+                    await pipe.execute()
+                    return new
+                except WatchError:
+                    continue
 
     async def get(self, key: str) -> Optional[Any]:
         if not self.redis:
@@ -62,8 +328,116 @@ class MessageBroker:
         
         value = await self.redis.get(key)
         if value:
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                return value
-        return None 
\ No newline at end of file
+            return self.serializer.loads(value)
+        return None
+
+    async def incr(self, key: str, expire: int) -> int:
+        """Increment the counter at key and (re)set its TTL, returns the new count"""
+        if not self.redis:
+            await self.connect()
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, expire)
+            count, _ = await pipe.execute()
+        return count
+
+    async def expire(self, key: str, seconds: int):
+        if not self.redis:
+            await self.connect()
+
+        await self.redis.expire(key, seconds)
+
+    async def delete(self, *keys: str):
+        if not self.redis:
+            await self.connect()
+
+        await self.redis.delete(*keys)
+
+    async def zadd(self, key: str, value: Any, score: float):
+        if not self.redis:
+            await self.connect()
+
+        await self.redis.zadd(key, {self.serializer.dumps(value): score})
+
+    async def zpop_by_score(self, key: str, max_score: float, limit: int = 100) -> List[Any]:
+        """Remove and return members scored up to max_score, safe to call from several consumers"""
+        if not self.redis:
+            await self.connect()
+
+        members = await self.redis.zrangebyscore(key, "-inf", max_score, start=0, num=limit)
+        if not members:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for member in members:
+                pipe.zrem(key, member)
+            removed = await pipe.execute()
+        # Only members this consumer actually removed are its to process
+        return [self.serializer.loads(member) for member, ok in zip(members, removed) if ok]
+
+    async def hset(self, key: str, field: str, value: Any):
+        if not self.redis:
+            await self.connect()
+
+        await self.redis.hset(key, field, self.serializer.dumps(value))
+
+    async def hgetall(self, key: str) -> Dict[str, Any]:
+        if not self.redis:
+            await self.connect()
+
+        values = await self.redis.hgetall(key)
+        return {field.decode("utf-8"): self.serializer.loads(value) for field, value in values.items()}
+
+    async def hpop(self, key: str, field: str) -> Optional[Any]:
+        """Remove a hash field and return its value"""
+        if not self.redis:
+            await self.connect()
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hget(key, field)
+            pipe.hdel(key, field)
+            value, _ = await pipe.execute()
+        return self.serializer.loads(value) if value else None
+
+    async def hincrby_many(self, counters: Dict[str, Dict[str, int]], index_key: Optional[str] = None):
+        """Increment integer hash fields of several keys in one round-trip, optionally listing the keys in a set"""
+        if not self.redis:
+            await self.connect()
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, fields in counters.items():
+                for field, amount in fields.items():
+                    pipe.hincrby(key, field, amount)
+            if index_key and counters:
+                pipe.sadd(index_key, *counters)
+            await pipe.execute()
+
+    async def pop_counters(self, index_key: str, limit: int = 100) -> Dict[str, Dict[str, int]]:
+        """Take up to `limit` counter hashes listed in index_key, each read and deleted atomically"""
+        if not self.redis:
+            await self.connect()
+
+        keys = await self.redis.spop(index_key, limit)
+        if not keys:
+            return {}
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+                pipe.delete(key)
+            results = await pipe.execute()
+        # Increments that land after the transaction recreate the key and list it again
+        counters = {}
+        for key, values in zip(keys, results[::2]):
+            if values:
+                counters[key.decode("utf-8")] = {field.decode("utf-8"): int(value) for field, value in values.items()}
+        return counters
+
+    async def mget(self, keys: List[str]) -> List[Optional[Any]]:
+        """Get several keys in a single round-trip, missing keys come back as None"""
+        if not self.redis:
+            await self.connect()
+
+        if not keys:
+            return []
+        values = await self.redis.mget(keys)
+        return [self.serializer.loads(value) if value else None for value in values]
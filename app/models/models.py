@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Date, DateTime, Numeric, Enum, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -24,6 +24,7 @@ class User(Base, TimestampMixin):
     subscriptions = relationship("Subscription", back_populates="user")
     transactions = relationship("Transaction", back_populates="user")
     messages = relationship("Message", back_populates="user")
+    usage = relationship("Usage", back_populates="user")
 
 class Subscription(Base, TimestampMixin):
     __tablename__ = "subscriptions"
@@ -55,4 +56,18 @@ class Message(Base, TimestampMixin):
     response = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
-    user = relationship("User", back_populates="messages") 
\ No newline at end of file
+    user = relationship("User", back_populates="messages") 
+
+class Usage(Base, TimestampMixin):
+    """LLM token usage per user and day, rolled up from the worker's Redis counters"""
+    __tablename__ = "usage"
+    __table_args__ = (UniqueConstraint("user_id", "period", name="uq_usage_user_period"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    period = Column(Date, nullable=False)
+    requests = Column(Integer, default=0, nullable=False)
+    prompt_tokens = Column(BigInteger, default=0, nullable=False)
+    completion_tokens = Column(BigInteger, default=0, nullable=False)
+
+    user = relationship("User", back_populates="usage")
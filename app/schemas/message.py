@@ -1,11 +1,14 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 
+from app.core.config import settings
+
 class MessageBase(BaseModel):
     content: str
 
 class MessageCreate(MessageBase):
-    content: str
+    # Cheap bound checked before anything is tokenized, the token limit is enforced per role
+    content: str = Field(max_length=settings.MESSAGE_MAX_CHARS)
 
 class Message(MessageBase):
     id: int
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional
 from app.models.models import UserRole
 
@@ -19,6 +19,19 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class UsageTotals(BaseModel):
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+class UserUsage(UsageTotals):
+    user_id: int
+    first_period: Optional[date] = None
+    last_period: Optional[date] = None
+
+class UserInfo(User):
+    usage: UsageTotals
+
 class UserInDB(User):
     pass
 
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from prometheus_client import Gauge
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY_LIMIT = Gauge(
+    "vllm_concurrency_limit",
+    "Current adaptive limit of in-flight requests per vLLM backend",
+    ["backend"],
+)
+IN_FLIGHT = Gauge(
+    "vllm_in_flight_requests",
+    "Requests currently being generated per vLLM backend",
+    ["backend"],
+)
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit driven by observed latency and errors.
+
+    Each completed request reports its latency sample (seconds per generated token,
+    so long and short answers are comparable) and whether it succeeded. The limit
+    grows by roughly one per window of successful requests while they are being
+    used, and shrinks multiplicatively on overload errors or when recent latency
+    rises above `tolerance` times the long-term baseline, i.e. when vLLM starts
+    queueing.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        initial_limit: int = 8,
+        backoff_ratio: float = 0.9,
+        tolerance: float = 1.5,
+        smoothing: float = 0.2,
+        baseline_smoothing: float = 0.001
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.backoff_ratio = backoff_ratio
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baseline_smoothing = baseline_smoothing
+        self.in_flight = 0
+        self.recent_latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self._condition = asyncio.Condition()
+        CONCURRENCY_LIMIT.labels(backend=name).set(self.limit)
+
+    @property
+    def available(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.available)
+            self.in_flight += 1
+            IN_FLIGHT.labels(backend=self.name).set(self.in_flight)
+
+    def try_acquire(self) -> bool:
+        if not self.available:
+            return False
+        self.in_flight += 1
+        IN_FLIGHT.labels(backend=self.name).set(self.in_flight)
+        return True
+
+    async def release(self, latency: float, success: bool, overloaded: bool = True):
+        """
+        Return a slot. A failed request lowers the limit only when `overloaded`, so that
+        client errors such as an oversized prompt do not throttle everyone else.
+        """
+        async with self._condition:
+            was_saturated = self.in_flight >= self.limit / 2
+            self.in_flight -= 1
+            IN_FLIGHT.labels(backend=self.name).set(self.in_flight)
+            self._update(latency, success, overloaded, was_saturated)
+            self._condition.notify_all()
+
+    def _update(self, latency: float, success: bool, overloaded: bool, was_saturated: bool):
+        if not success:
+            if overloaded:
+                self._decrease("error")
+            return
+
+        if self.recent_latency is None:
+            self.recent_latency = self.baseline_latency = latency
+        else:
+            self.recent_latency += self.smoothing * (latency - self.recent_latency)
+            # The baseline approximates no-load latency: it follows drops at once and
+            # rises only slowly, so sustained queueing shows up as a high ratio
+            if self.recent_latency < self.baseline_latency:
+                self.baseline_latency = self.recent_latency
+            else:
+                self.baseline_latency += self.baseline_smoothing * (self.recent_latency - self.baseline_latency)
+
+        if self.recent_latency > self.tolerance * self.baseline_latency:
+            self._decrease("latency")
+        elif was_saturated:
+            # Only grow a limit that is actually being used
+            self._set_limit(self.limit + 1 / self.limit)
+
+    def _decrease(self, reason: str):
+        new_limit = self.limit * self.backoff_ratio
+        if int(new_limit) < int(self.limit):
+            logger.info("Lowering %s concurrency limit to %d (%s)", self.name, max(int(new_limit), self.min_limit), reason)
+        self._set_limit(new_limit)
+
+    def _set_limit(self, limit: float):
+        self.limit = max(float(self.min_limit), min(limit, float(self.max_limit)))
+        CONCURRENCY_LIMIT.labels(backend=self.name).set(int(self.limit))
+
+_limiters: Dict[str, AdaptiveConcurrencyLimiter] = {}
+
+def get_limiter(backend: str) -> AdaptiveConcurrencyLimiter:
+    """Limiter for a vLLM backend, created from settings on first use"""
+    limiter = _limiters.get(backend)
+    if limiter is None:
+        from app.core.config import settings
+        limiter = _limiters[backend] = AdaptiveConcurrencyLimiter(
+            backend,
+            min_limit=settings.VLLM_CONCURRENCY_MIN,
+            max_limit=settings.VLLM_CONCURRENCY_MAX,
+            initial_limit=settings.VLLM_CONCURRENCY_INITIAL,
+            backoff_ratio=settings.VLLM_CONCURRENCY_BACKOFF,
+            tolerance=settings.VLLM_LATENCY_TOLERANCE
+        )
+    return limiter
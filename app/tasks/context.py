@@ -0,0 +1,151 @@
+import logging
+from typing import Any, Dict, List, Sequence
+
+from prometheus_client import Counter
+from sqlalchemy.orm import Session
+
+from app.message_broker import MessageBroker
+from app.models.models import Message
+from app.tasks.tokens import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_MISSES = Counter(
+    "llm_context_cache_misses_total",
+    "Conversation contexts rebuilt from the messages table",
+)
+CONTEXT_ROLLUPS = Counter(
+    "llm_context_rollups_total",
+    "Times older turns were rolled into the conversation summary",
+)
+
+# Characters of each side of a turn kept in the summary
+SUMMARY_LINE_CHARS = 200
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+class ConversationContext:
+    """
+    Builds the chat messages sent to vLLM for a user's new message.
+
+    The user's recent turns are cached in Redis, and rebuilt from the messages
+    table on a cache miss. Prompts are laid out as system prompt, summary of older
+    turns, recent turns and the new message. When the turns no longer fit in
+    `max_tokens` (or exceed `max_turns`), at least the older half of them is rolled
+    into the summary at once, so the prompt prefix stays unchanged over the next
+    several turns and vLLM's automatic prefix caching keeps reusing its KV cache.
+    """
+
+    def __init__(
+        self,
+        broker: MessageBroker,
+        system_prompt: str,
+        max_tokens: int,
+        max_turns: int,
+        summary_max_tokens: int,
+        ttl: int,
+        incomplete_responses: Sequence[str] = ()
+    ):
+        self.broker = broker
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.ttl = ttl
+        # Placeholder and error responses that are not part of the conversation
+        self.incomplete_responses = tuple(incomplete_responses)
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"conversation:{user_id}"
+
+    async def build(self, db: Session, message: Message) -> List[Dict[str, str]]:
+        if self.max_tokens <= 0:
+            return self._layout("", [], message.content)
+
+        message_tokens = estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+
+        def fit(state):
+            changed = state is None
+            if state is None:
+                CONTEXT_CACHE_MISSES.inc()
+                state = self._load(db, message)
+            while state["turns"] and not self._fits(state, message_tokens):
+                state = self._roll_up(state)
+                changed = True
+            return state if changed else None
+
+        # Atomic, so turns appended by concurrent requests of the same user are not lost
+        state = await self.broker.update(self._key(message.user_id), fit, expire=self.ttl)
+        return self._layout(state["summary"], state["turns"], message.content)
+
+    async def append_turn(self, message: Message):
+        """Add a completed turn to the cached context, a missing cache is rebuilt on the next build"""
+        turn = self._turn(message.id, message.content, message.response)
+
+        def append(state):
+            if state is None:
+                return None
+            state["turns"].append(turn)
+            return state
+
+        await self.broker.update(self._key(message.user_id), append, expire=self.ttl)
+
+    def _load(self, db: Session, message: Message) -> Dict[str, Any]:
+        # Twice the turn limit, so the older half seeds the summary
+        rows = db.query(Message.id, Message.content, Message.response).filter(
+            Message.user_id == message.user_id,
+            Message.id < message.id,
+            Message.response.notin_(self.incomplete_responses)
+        ).order_by(Message.id.desc()).limit(self.max_turns * 2).all()
+        turns = [self._turn(*row) for row in reversed(rows)]
+        return {"summary": "", "summary_tokens": 0, "turns": turns}
+
+    @staticmethod
+    def _turn(message_id: int, content: str, response: str) -> Dict[str, Any]:
+        tokens = estimate_tokens(content) + estimate_tokens(response) + 2 * MESSAGE_OVERHEAD_TOKENS
+        return {"id": message_id, "content": content, "response": response, "tokens": tokens}
+
+    def _fits(self, state: Dict[str, Any], message_tokens: int) -> bool:
+        if len(state["turns"]) > self.max_turns:
+            return False
+        used = (
+            estimate_tokens(self.system_prompt)
+            + state["summary_tokens"]
+            + sum(turn["tokens"] for turn in state["turns"])
+            + message_tokens
+            + MESSAGE_OVERHEAD_TOKENS
+        )
+        return used <= self.max_tokens
+
+    def _roll_up(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        turns = state["turns"]
+        split = max(1, len(turns) // 2)
+        lines = state["summary"].splitlines() if state["summary"] else []
+        for turn in turns[:split]:
+            lines.append(
+                f"- User: {_clip(turn['content'], SUMMARY_LINE_CHARS)} "
+                f"Assistant: {_clip(turn['response'], SUMMARY_LINE_CHARS)}"
+            )
+
+        # The oldest lines go first once the summary is over its own budget
+        summary = "\n".join(lines)
+        while lines and estimate_tokens(summary) > self.summary_max_tokens:
+            lines.pop(0)
+            summary = "\n".join(lines)
+
+        CONTEXT_ROLLUPS.inc()
+        logger.debug("Rolled %d turns into the conversation summary", split)
+        return {"summary": summary, "summary_tokens": estimate_tokens(summary), "turns": turns[split:]}
+
+    def _layout(self, summary: str, turns: List[Dict[str, Any]], content: str) -> List[Dict[str, str]]:
+        # Most stable first: the system prompt never changes, the summary only on roll-ups
+        system = [part for part in (self.system_prompt, summary and f"Summary of the earlier conversation:\n{summary}") if part]
+        messages = [{"role": "system", "content": "\n\n".join(system)}] if system else []
+        for turn in turns:
+            messages.append({"role": "user", "content": turn["content"]})
+            messages.append({"role": "assistant", "content": turn["response"]})
+        messages.append({"role": "user", "content": content})
+        return messages
@@ -1,70 +1,185 @@
 import logging
-import os
-from openai import OpenAI
+import time
+from typing import Dict, List, Optional
+from openai import AsyncOpenAI
 from app.core.config import settings
 from app.db.session import SessionLocal
 from app.models.models import Message
+from sqlalchemy.orm import joinedload
 from app.message_broker import MessageBroker
+from app.tasks.context import ConversationContext
+from app.tasks.retry_queue import RetryQueue, is_retryable
+from app.tasks.routing import ModelRouter
+from app.tasks.tokens import estimate_message_tokens
+from app.tasks.usage import UsageMeter
 import asyncio
 
 logger = logging.getLogger(__name__)
 
-message_broker = MessageBroker(redis_url=settings.REDIS_URL)
+PROCESSING_RESPONSE = "Processing..."
+ERROR_RESPONSE = "Error processing request. Please try again later."
+LLM_ERROR_RESPONSE = "Error getting response from LLM. Please try again later."
+
+message_broker = MessageBroker.from_settings(name="tasks")
+response_listener = message_broker.listener("vllm_response_*")
+retry_queue = RetryQueue(
+    message_broker,
+    max_attempts=settings.LLM_MAX_ATTEMPTS,
+    base_delay=settings.LLM_RETRY_BASE_DELAY,
+    max_delay=settings.LLM_RETRY_MAX_DELAY
+)
+
+router = ModelRouter.from_settings()
+usage_meter = UsageMeter(message_broker, batch_size=settings.USAGE_FLUSH_BATCH_SIZE)
+conversation = ConversationContext(
+    message_broker,
+    system_prompt=settings.LLM_SYSTEM_PROMPT,
+    max_tokens=settings.CONTEXT_MAX_TOKENS,
+    max_turns=settings.CONTEXT_MAX_TURNS,
+    summary_max_tokens=settings.CONTEXT_SUMMARY_MAX_TOKENS,
+    ttl=settings.CONTEXT_CACHE_TTL,
+    incomplete_responses=(PROCESSING_RESPONSE, ERROR_RESPONSE, LLM_ERROR_RESPONSE)
+)
+
+_vllm_clients: Dict[str, AsyncOpenAI] = {}
+
+def get_vllm_client(base_url: str) -> AsyncOpenAI:
+    """Shared client per backend, so connections are reused across requests"""
+    client = _vllm_clients.get(base_url)
+    if client is None:
+        client = _vllm_clients[base_url] = AsyncOpenAI(
+            base_url=base_url,
+            api_key="not-needed",
+            timeout=settings.LLM_REQUEST_TIMEOUT,
+            max_retries=0
+        )
+    return client
+
+async def close_vllm_clients():
+    for client in _vllm_clients.values():
+        await client.close()
+    _vllm_clients.clear()
 
 async def process_llm_request(message_id: int) -> None:
-    logger.info(f"Starting to process LLM request for message_id: {message_id}")
+    logger.info("Starting to process LLM request for message_id: %s", message_id)
     db = SessionLocal()
     try:
-        message = db.query(Message).filter(Message.id == message_id).first()
+        message = db.query(Message).options(joinedload(Message.user)).filter(Message.id == message_id).first()
         if not message:
-            logger.error(f"Message not found with id: {message_id}")
+            logger.error("Message not found with id: %s", message_id)
             return
 
-        logger.info(f"Retrieved message content: {message.content[:100]}...")
-        
-        await message_broker.publish(
-            "vllm_requests",
-            {
-                "message_id": message_id,
-                "content": message.content
-            }
-        )
-        
-        pubsub = await message_broker.subscribe(f"vllm_response_{message_id}")
+        logger.debug("Retrieved message content: %.100s...", message.content)
+
+        try:
+            prompt = await conversation.build(db, message)
+        except Exception as e:
+            # History is an improvement, not a requirement for answering
+            logger.warning("Could not build conversation context for message_id %s: %s", message_id, e)
+            prompt = [{"role": "user", "content": message.content}]
         
-        while True:
-            response = await message_broker.get_message(pubsub)
-            if response:
-                message.response = response["response"]
-                db.commit()
-                break
-            await asyncio.sleep(0.1)
+        deadline = time.time() + settings.LLM_REQUEST_DEADLINE
+
+        async with response_listener.expect(f"vllm_response_{message_id}") as replies:
+            await message_broker.publish(
+                "vllm_requests",
+                {
+                    "message_id": message_id,
+                    "content": message.content,
+                    "messages": prompt,
+                    "deadline": deadline,
+                    "role": message.user.role.value,
+                    "user_id": message.user_id
+                }
+            )
+
+            try:
+                # Retries happen inside the deadline, the grace period covers the final attempt
+                response = await asyncio.wait_for(
+                    replies.get(),
+                    deadline + settings.LLM_REQUEST_TIMEOUT - time.time()
+                )
+            except asyncio.TimeoutError:
+                response = None
+
+        if response:
+            message.response = response["response"]
+            db.commit()
+            if not response.get("error"):
+                try:
+                    await conversation.append_turn(message)
+                except Exception as e:
+                    logger.warning("Could not cache conversation turn for message_id %s: %s", message_id, e)
+        else:
+            logger.error("Timed out waiting for LLM response for message_id: %s", message_id)
+            message.response = ERROR_RESPONSE
+            db.commit()
             
     except Exception as e:
-        logger.error(f"Error processing LLM request: {str(e)}", exc_info=True)
+        logger.error("Error processing LLM request: %s", e, exc_info=True)
         if message:
-            message.response = "Error processing request. Please try again later."
+            message.response = ERROR_RESPONSE
             db.commit()
     finally:
         db.close()
 
-async def process_vllm_response(message_id: int, content: str) -> None:
+async def process_vllm_response(
+    message_id: int,
+    content: str,
+    attempt: int = 1,
+    deadline: Optional[float] = None,
+    role: Optional[str] = None,
+    messages: Optional[List[Dict[str, str]]] = None,
+    user_id: Optional[int] = None
+) -> None:
+    job = {
+        "user_id": user_id,
+        "message_id": message_id,
+        "content": content,
+        "messages": messages,
+        "attempt": attempt,
+        "deadline": deadline or time.time() + settings.LLM_REQUEST_DEADLINE,
+        "role": role
+    }
+    if time.time() >= job["deadline"]:
+        # The caller may still wait out its grace period, so it gets a final answer right away
+        await publish_error_response(message_id)
+        await retry_queue.dead_letter(job, TimeoutError("Request deadline passed before processing"), reason="deadline")
+        return
+
     try:
-        vllm_api_url = os.environ.get('VLLM_API_URL', settings.VLLM_API_URL)
-        logger.info(f"Using vLLM API URL: {vllm_api_url}")
-        
-        client = OpenAI(
-            base_url=vllm_api_url,
-            api_key="not-needed",
-            timeout=30.0
-        )
-        
-        response = client.chat.completions.create(
-            model=settings.VLLM_MODEL_NAME,
-            messages=[
-                {"role": "user", "content": content}
-            ]
-        )
+        # Requests published before conversation context existed carry only the content
+        prompt = messages or [{"role": "user", "content": content}]
+        route = router.select(estimate_message_tokens(prompt), role)
+        route = await router.acquire(route)
+        logger.debug("Using route %s (%s at %s) for message_id %s", route.name, route.model, route.base_url, message_id)
+
+        client = get_vllm_client(route.base_url)
+        limiter = router.limiter(route)
+
+        profile = settings.generation_profile(role)
+
+        started_at = time.monotonic()
+        latency, success, overloaded = None, False, False
+        try:
+            response = await client.chat.completions.create(
+                model=route.model,
+                messages=prompt,
+                max_tokens=profile.max_output_tokens,
+                temperature=profile.temperature,
+                top_p=profile.top_p,
+                stop=profile.stop
+            )
+            success = True
+            # Per generated token, so that long and short answers are comparable
+            completion_tokens = response.usage.completion_tokens if response.usage else 0
+            latency = (time.monotonic() - started_at) / max(completion_tokens, 1)
+        except Exception as e:
+            # Only errors that point at load on vLLM (the retryable ones) lower its limit
+            overloaded = is_retryable(e)
+            raise
+        finally:
+            await limiter.release(latency or 0.0, success, overloaded)
         
         await message_broker.publish(
             f"vllm_response_{message_id}",
@@ -73,13 +188,27 @@ async def process_vllm_response(message_id: int, content: str) -> None:
                 "response": response.choices[0].message.content
             }
         )
+
+        if user_id is not None and response.usage:
+            try:
+                await usage_meter.record(user_id, response.usage.prompt_tokens, response.usage.completion_tokens)
+            except Exception as e:
+                # The user has the answer already, a lost counter must not trigger a retry
+                logger.warning("Could not record token usage for message_id %s: %s", message_id, e)
         
     except Exception as e:
-        logger.error(f"Error getting response from VLLM: {str(e)}", exc_info=True)
-        await message_broker.publish(
-            f"vllm_response_{message_id}",
-            {
-                "message_id": message_id,
-                "response": "Error getting response from LLM. Please try again later."
-            }
-        ) 
\ No newline at end of file
+        if await retry_queue.retry_or_dead_letter(job, e):
+            return
+        logger.error("Error getting response from VLLM: %s", e, exc_info=True)
+        await publish_error_response(message_id)
+
+async def publish_error_response(message_id: int):
+    """Tell the API that no answer is coming for message_id"""
+    await message_broker.publish(
+        f"vllm_response_{message_id}",
+        {
+            "message_id": message_id,
+            "response": LLM_ERROR_RESPONSE,
+            "error": True
+        }
+    ) 
\ No newline at end of file
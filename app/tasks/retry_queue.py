@@ -0,0 +1,110 @@
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+import openai
+from prometheus_client import Counter
+
+from app.message_broker import MessageBroker
+
+logger = logging.getLogger(__name__)
+
+RETRY_QUEUE_KEY = "vllm_retry_queue"
+DEAD_LETTER_KEY = "vllm_dead_letters"
+
+LLM_RETRIES = Counter(
+    "llm_request_retries_total",
+    "LLM requests scheduled for another attempt",
+)
+LLM_DEAD_LETTERS = Counter(
+    "llm_request_dead_letters_total",
+    "LLM requests moved to the dead-letter queue",
+    ["reason"],
+)
+
+# Errors worth another attempt: vLLM unreachable, restarting, overloaded or too slow
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    # 5xx responses that openai does not map to InternalServerError, e.g. 502/503 from a proxy
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff for the given (1-based) attempt"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+class RetryQueue:
+    """
+    Delayed retries and dead letters for LLM jobs.
+
+    Retries are kept in a Redis sorted set scored by the time they become due, so any
+    worker can pick them up. Jobs that fail fatally, run out of attempts or would miss
+    their deadline are stored in a dead-letter hash keyed by message_id for inspection
+    and replay.
+    """
+
+    def __init__(self, broker: MessageBroker, max_attempts: int, base_delay: float, max_delay: float):
+        self.broker = broker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    async def retry_or_dead_letter(self, job: Dict[str, Any], error: BaseException) -> bool:
+        """Schedule another attempt if the error and budget allow it, returns False if dead-lettered"""
+        attempt = job.get("attempt", 1)
+        if not is_retryable(error):
+            await self.dead_letter(job, error, reason="fatal")
+            return False
+        if attempt >= self.max_attempts:
+            await self.dead_letter(job, error, reason="max_attempts")
+            return False
+
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        due_at = time.time() + delay
+        if due_at >= job["deadline"]:
+            await self.dead_letter(job, error, reason="deadline")
+            return False
+
+        LLM_RETRIES.inc()
+        logger.warning(
+            "Attempt %d for message_id %s failed (%s), retrying in %.1fs",
+            attempt, job["message_id"], error, delay
+        )
+        await self.broker.zadd(RETRY_QUEUE_KEY, {**job, "attempt": attempt + 1}, due_at)
+        return True
+
+    async def requeue(self, job: Dict[str, Any]):
+        """Hand back a job interrupted by shutdown so that another worker runs it right away"""
+        await self.broker.zadd(RETRY_QUEUE_KEY, job, time.time())
+
+    async def pop_due(self, limit: int = 100) -> List[Dict[str, Any]]:
+        return await self.broker.zpop_by_score(RETRY_QUEUE_KEY, time.time(), limit)
+
+    async def dead_letter(self, job: Dict[str, Any], error: BaseException, reason: str):
+        LLM_DEAD_LETTERS.labels(reason=reason).inc()
+        logger.error("Moving message_id %s to the dead-letter queue (%s): %s", job["message_id"], reason, error)
+        await self.broker.hset(
+            DEAD_LETTER_KEY,
+            str(job["message_id"]),
+            {
+                "job": job,
+                "reason": reason,
+                "error": f"{type(error).__name__}: {error}",
+                "failed_at": time.time(),
+            }
+        )
+
+    async def list_dead_letters(self) -> List[Dict[str, Any]]:
+        entries = await self.broker.hgetall(DEAD_LETTER_KEY)
+        return sorted(entries.values(), key=lambda entry: entry["failed_at"], reverse=True)
+
+    async def take_dead_letter(self, message_id: int) -> Optional[Dict[str, Any]]:
+        return await self.broker.hpop(DEAD_LETTER_KEY, str(message_id))
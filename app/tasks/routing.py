@@ -0,0 +1,85 @@
+import logging
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter
+
+from app.core.config import VLLMRoute
+from app.tasks.concurrency import AdaptiveConcurrencyLimiter, get_limiter
+
+logger = logging.getLogger(__name__)
+
+ROUTE_REQUESTS = Counter(
+    "llm_route_requests_total",
+    "LLM requests sent to each model route",
+    ["route"],
+)
+ROUTE_FALLBACKS = Counter(
+    "llm_route_fallbacks_total",
+    "LLM requests moved to a fallback route because the selected one was saturated",
+    ["route", "fallback"],
+)
+
+class ModelRouter:
+    """
+    Picks the model/backend for an LLM request.
+
+    Routes are checked in order and the first one whose prompt size range and roles
+    match the request is selected, so specific rules go before the catch-all. When
+    the selected backend's adaptive concurrency limit is reached and the route has a
+    fallback with free capacity, the request goes to the fallback instead of queueing.
+    """
+
+    def __init__(self, routes: List[VLLMRoute]):
+        if not routes:
+            raise ValueError("At least one vLLM route is required")
+        self.routes = routes
+        self._by_name: Dict[str, VLLMRoute] = {route.name: route for route in routes}
+        for route in routes:
+            if route.fallback and route.fallback not in self._by_name:
+                raise ValueError(f"Unknown fallback route {route.fallback!r} for route {route.name!r}")
+
+    @classmethod
+    def from_settings(cls) -> "ModelRouter":
+        from app.core.config import settings
+        routes = settings.VLLM_ROUTES or [
+            VLLMRoute(name="default", model=settings.VLLM_MODEL_NAME, base_url=settings.VLLM_API_URL)
+        ]
+        return cls(routes)
+
+    def select(self, prompt_tokens: int, role: Optional[str] = None) -> VLLMRoute:
+        for route in self.routes:
+            if prompt_tokens < route.min_prompt_tokens:
+                continue
+            if route.max_prompt_tokens is not None and prompt_tokens > route.max_prompt_tokens:
+                continue
+            if route.roles is not None and role not in route.roles:
+                continue
+            return route
+        # Nothing matched, the last route is the catch-all
+        return self.routes[-1]
+
+    async def acquire(self, route: VLLMRoute) -> VLLMRoute:
+        """Reserve a slot on the route or its fallback, returns the route that got it"""
+        limiter = self.limiter(route)
+        if not limiter.try_acquire():
+            fallback = self._by_name.get(route.fallback) if route.fallback else None
+            if fallback is not None and self.limiter(fallback).try_acquire():
+                logger.info("Route %s is saturated, using %s", route.name, fallback.name)
+                ROUTE_FALLBACKS.labels(route=route.name, fallback=fallback.name).inc()
+                route = fallback
+            else:
+                await limiter.acquire()
+        ROUTE_REQUESTS.labels(route=route.name).inc()
+        return route
+
+    @staticmethod
+    def limiter(route: VLLMRoute) -> AdaptiveConcurrencyLimiter:
+        # Limits are per backend, routes sharing a vLLM server share its capacity
+        return get_limiter(route.base_url)
+
+    def backends(self) -> List[VLLMRoute]:
+        """One route per distinct backend and model, e.g. for warm-up"""
+        seen = {}
+        for route in self.routes:
+            seen.setdefault((route.base_url, route.model), route)
+        return list(seen.values())
@@ -0,0 +1,64 @@
+import logging
+import math
+import os
+from typing import Dict, List
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # pragma: no cover
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+# Rough average for BPE tokenizers on mixed English/Russian text
+CHARS_PER_TOKEN = 3.5
+# Role markers and separators the chat template adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_tokenizer = None
+
+def load_tokenizer():
+    """
+    Load the served model's tokenizer if TOKENIZER_NAME is set and `tokenizers` is installed.
+
+    TOKENIZER_NAME is a local tokenizer.json or a Hugging Face model downloaded at
+    TOKENIZER_REVISION. Loading blocks, possibly on a download, so it runs at startup
+    in a thread; until then tokens are estimated from length.
+    """
+    global _tokenizer
+    from app.core.config import settings
+    if not settings.TOKENIZER_NAME:
+        return
+    if Tokenizer is None:
+        logger.warning("TOKENIZER_NAME is set but the tokenizers package is not installed, estimating tokens from length")
+        return
+    try:
+        if os.path.isfile(settings.TOKENIZER_NAME):
+            _tokenizer = Tokenizer.from_file(settings.TOKENIZER_NAME)
+        else:
+            _tokenizer = Tokenizer.from_pretrained(settings.TOKENIZER_NAME, revision=settings.TOKENIZER_REVISION)
+    except Exception as e:
+        logger.warning("Could not load tokenizer %s, estimating tokens from length: %s", settings.TOKENIZER_NAME, e)
+
+def get_tokenizer():
+    """The tokenizer loaded by load_tokenizer, None if there is none"""
+    return _tokenizer
+
+def estimate_tokens(text: str) -> int:
+    """Number of tokens in text, counted locally without calling vLLM"""
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of text that fits in max_tokens"""
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        ids = tokenizer.encode(text, add_special_tokens=False).ids
+        return text if len(ids) <= max_tokens else tokenizer.decode(ids[:max_tokens])
+    return text[:int(max_tokens * CHARS_PER_TOKEN)]
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Prompt size of a chat completion request"""
+    return sum(estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from datetime import date, datetime
+from typing import Dict, List
+
+from prometheus_client import Counter
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+from app.message_broker import MessageBroker
+from app.models.models import Usage
+
+logger = logging.getLogger(__name__)
+
+USAGE_INDEX_KEY = "usage:pending"
+# Dialects with INSERT ... ON CONFLICT, others fall back to a select and update/insert
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens processed by vLLM",
+    ["kind"],
+)
+USAGE_ROWS_FLUSHED = Counter(
+    "usage_rows_flushed_total",
+    "Per-user usage counters rolled up into the usage table",
+)
+
+class UsageMeter:
+    """
+    Token usage per user and day.
+
+    The worker increments Redis hash counters for every response, which is one
+    pipelined round-trip and never touches Postgres. `flush` periodically takes the
+    pending counters and adds them to the aggregated `usage` table in batches;
+    counters that could not be written are put back so nothing is lost.
+    """
+
+    def __init__(self, broker: MessageBroker, batch_size: int = 500):
+        self.broker = broker
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _key(user_id: int, period: date) -> str:
+        return f"usage:{user_id}:{period.isoformat()}"
+
+    async def record(self, user_id: int, prompt_tokens: int, completion_tokens: int):
+        LLM_TOKENS.labels(kind="prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(kind="completion").inc(completion_tokens)
+        await self.broker.hincrby_many(
+            {
+                self._key(user_id, datetime.utcnow().date()): {
+                    "requests": 1,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                }
+            },
+            index_key=USAGE_INDEX_KEY
+        )
+
+    async def flush(self) -> int:
+        """Move all pending counters to the usage table, returns the number of rows written"""
+        flushed = 0
+        while True:
+            counters = await self.broker.pop_counters(USAGE_INDEX_KEY, self.batch_size)
+            if not counters:
+                return flushed
+
+            rows = []
+            for key, values in counters.items():
+                _, user_id, period = key.split(":")
+                rows.append({
+                    "user_id": int(user_id),
+                    "period": date.fromisoformat(period),
+                    "requests": values.get("requests", 0),
+                    "prompt_tokens": values.get("prompt_tokens", 0),
+                    "completion_tokens": values.get("completion_tokens", 0),
+                })
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except Exception:
+                await self.broker.hincrby_many(counters, index_key=USAGE_INDEX_KEY)
+                raise
+            USAGE_ROWS_FLUSHED.inc(len(rows))
+            flushed += len(rows)
+
+    @classmethod
+    def _write(cls, rows: List[Dict]):
+        db = SessionLocal()
+        try:
+            insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+            if insert is not None:
+                cls._upsert(db, insert, rows)
+            else:
+                cls._merge(db, rows)
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _upsert(db: Session, insert, rows: List[Dict]):
+        now = datetime.utcnow()
+        table = Usage.__table__
+        statement = insert(table).values([{**row, "created_at": now, "updated_at": now} for row in rows])
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.period],
+            set_={
+                "requests": table.c.requests + statement.excluded.requests,
+                "prompt_tokens": table.c.prompt_tokens + statement.excluded.prompt_tokens,
+                "completion_tokens": table.c.completion_tokens + statement.excluded.completion_tokens,
+                "updated_at": statement.excluded.updated_at,
+            }
+        )
+        db.execute(statement)
+
+    @staticmethod
+    def _merge(db: Session, rows: List[Dict]):
+        """Add to existing rows and insert the missing ones, for dialects without ON CONFLICT"""
+        # A concurrent insert of the same row fails on uq_usage_user_period, and flush puts the counters back
+        existing = {
+            (usage.user_id, usage.period): usage
+            for usage in db.scalars(
+                select(Usage).where(
+                    Usage.user_id.in_({row["user_id"] for row in rows}),
+                    Usage.period.in_({row["period"] for row in rows})
+                ).with_for_update()
+            )
+        }
+        for row in rows:
+            usage = existing.get((row["user_id"], row["period"]))
+            if usage is None:
+                db.add(Usage(**row))
+            else:
+                usage.requests += row["requests"]
+                usage.prompt_tokens += row["prompt_tokens"]
+                usage.completion_tokens += row["completion_tokens"]
@@ -1,14 +1,21 @@
 import logging
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, BaseMiddleware, types
 from aiogram.filters.command import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Update
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from prometheus_client import start_http_server
 from datetime import datetime
 import asyncio
 import time
 import httpx
-from typing import Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 from app.core.config import settings
+from app.core.instrumentation import start_loop_lag_monitor
+from app.core.shutdown import GracefulShutdown
+from app.message_broker import MessageBroker
+from app.telegram_sender import OutboundSender
 from app.models import models
 
 logger = logging.getLogger(__name__)
@@ -30,12 +37,18 @@ class APIClient:
         self._access_token = data["access_token"]
         return self._access_token
 
-    async def create_message(self, content: str) -> dict:
+    def _headers(self, idempotency_key: Optional[str] = None) -> dict:
+        headers = {"Authorization": f"Bearer {self._access_token}"}
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        return headers
+
+    async def create_message(self, content: str, idempotency_key: Optional[str] = None) -> dict:
         """Create a new message through the API"""
         response = await self.client.post(
             f"{self.base_url}/message",
             json={"content": content},
-            headers={"Authorization": f"Bearer {self._access_token}"}
+            headers=self._headers(idempotency_key)
         )
         response.raise_for_status()
         return response.json()
@@ -49,21 +62,21 @@ class APIClient:
         response.raise_for_status()
         return response.json()
 
-    async def create_subscription(self) -> dict:
+    async def create_subscription(self, idempotency_key: Optional[str] = None) -> dict:
         """Create a new subscription"""
         response = await self.client.post(
             f"{self.base_url}/subscribe",
-            headers={"Authorization": f"Bearer {self._access_token}"}
+            headers=self._headers(idempotency_key)
         )
         response.raise_for_status()
         return response.json()
 
-    async def add_coins(self, amount: int) -> dict:
+    async def add_coins(self, amount: int, idempotency_key: Optional[str] = None) -> dict:
         """Add coins to user's wallet"""
         response = await self.client.post(
             f"{self.base_url}/add_coins",
             json={"amount": amount},
-            headers={"Authorization": f"Bearer {self._access_token}"}
+            headers=self._headers(idempotency_key)
         )
         response.raise_for_status()
         return response.json()
@@ -72,16 +85,136 @@ class APIClient:
         """Close the HTTP client"""
         await self.client.aclose()
 
+class UpdateDeduplicationMiddleware(BaseMiddleware):
+    """
+    Drop updates whose update_id was already handled by any bot replica.
+
+    The update_id is claimed before the handler runs so concurrent redeliveries
+    are skipped, and released again if the handler fails so Telegram's next
+    redelivery of the update is processed instead of dropped.
+    """
+
+    def __init__(self, broker: MessageBroker, ttl: int):
+        self.broker = broker
+        self.ttl = ttl
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        try:
+            is_new = await self.broker.set_nx(self._key(event.update_id), 1, expire=self.ttl)
+        except Exception as e:
+            # Prefer a possible duplicate over dropping the update when Redis is unavailable
+            logger.warning("Could not check update %s for duplicates: %s", event.update_id, e)
+            is_new = True
+
+        if not is_new:
+            logger.info("Skipping duplicate update %s", event.update_id)
+            return None
+        try:
+            return await handler(event, data)
+        except Exception:
+            try:
+                await self.broker.delete(self._key(event.update_id))
+            except Exception as e:
+                logger.warning("Could not release update %s after a failure: %s", event.update_id, e)
+            raise
+
+    @staticmethod
+    def _key(update_id: int) -> str:
+        return f"telegram_update:{update_id}"
+
+class ChatDispatcher:
+    """
+    Serialises message processing per chat.
+
+    Messages that arrive within the debounce window of each other, or while an
+    earlier batch of the same chat is still being processed, are handed to the
+    handler together so a burst of short messages becomes a single prompt.
+    With `supersede` enabled a newer message drops the still-queued older ones instead.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Message]], Awaitable[None]],
+        debounce: float,
+        supersede: bool = False
+    ):
+        self.handler = handler
+        self.debounce = debounce
+        self.supersede = supersede
+        self._pending: Dict[int, List[Message]] = {}
+        self._last_received: Dict[int, float] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._draining = asyncio.Event()
+
+    def submit(self, message: Message):
+        chat_id = message.chat.id
+        pending = self._pending.setdefault(chat_id, [])
+        if self.supersede and pending:
+            logger.info("Dropping %d queued message(s) in chat %s superseded by a newer one", len(pending), chat_id)
+            pending.clear()
+        pending.append(message)
+        self._last_received[chat_id] = asyncio.get_running_loop().time()
+
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._run(chat_id))
+
+    async def _run(self, chat_id: int):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending.get(chat_id):
+                # Wait until the chat has been quiet for the whole debounce window
+                delay = self._last_received[chat_id] + self.debounce - loop.time()
+                while delay > 0 and not self._draining.is_set():
+                    try:
+                        await asyncio.wait_for(self._draining.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    delay = self._last_received[chat_id] + self.debounce - loop.time()
+
+                batch = self._pending.pop(chat_id)
+                try:
+                    await self.handler(batch)
+                except Exception as e:
+                    logger.error("Error processing messages for chat %s: %s", chat_id, e, exc_info=True)
+        finally:
+            self._workers.pop(chat_id, None)
+            self._last_received.pop(chat_id, None)
+
+    async def drain(self, shutdown: GracefulShutdown):
+        """Process what is already queued, cancelling chats that miss the drain timeout"""
+        # No more messages are coming, so stop waiting out the debounce window
+        self._draining.set()
+        for task in await shutdown.drain(self._workers.values(), "chats"):
+            task.cancel()
+
 bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
 dp = Dispatcher()
 api_client = APIClient(base_url=settings.API_URL)
+message_broker = MessageBroker.from_settings(name="bot")
+outbound = OutboundSender(
+    bot,
+    global_rate=settings.TELEGRAM_GLOBAL_RATE,
+    chat_rate=settings.TELEGRAM_CHAT_RATE,
+    chat_burst=settings.TELEGRAM_CHAT_BURST,
+    group_rate=settings.TELEGRAM_GROUP_RATE_PER_MIN / 60,
+    max_retries=settings.TELEGRAM_SEND_MAX_RETRIES,
+    broker=message_broker
+)
+
+dp.update.outer_middleware(UpdateDeduplicationMiddleware(message_broker, settings.TELEGRAM_UPDATE_DEDUP_TTL))
 
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
-    logger.info(f"Received /start command from user {message.from_user.id}")
+    logger.info("Received /start command from user %s", message.from_user.id)
     try:
         await api_client.get_token(str(message.from_user.id))
-        await message.answer(
+        await outbound.answer(
+            message,
             "Welcome! You've been registered. Use /subscribe to get access to the LLM service.\n\n"
             "💰 You can check your wallet balance with /wallet command.\n"
             "💡 Each minute of subscription costs coins from your wallet.\n"
@@ -89,21 +222,24 @@ async def cmd_start(message: Message):
         )
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 401:
-            await message.answer("Welcome back! You can send any message to interact with the LLM.")
+            await outbound.answer(message, "Welcome back! You can send any message to interact with the LLM.")
         else:
-            logger.error(f"Error in cmd_start: {str(e)}", exc_info=True)
-            await message.answer("An error occurred. Please try again later.")
+            logger.error("Error in cmd_start: %s", e, exc_info=True)
+            await outbound.answer(message, "An error occurred. Please try again later.")
     except Exception as e:
-        logger.error(f"Error in cmd_start: {str(e)}", exc_info=True)
-        await message.answer("An error occurred. Please try again later.")
+        logger.error("Error in cmd_start: %s", e, exc_info=True)
+        await outbound.answer(message, "An error occurred. Please try again later.")
 
 @dp.message(Command("subscribe"))
 async def cmd_subscribe(message: Message):
-    logger.info(f"Received /subscribe command from user {message.from_user.id}")
+    logger.info("Received /subscribe command from user %s", message.from_user.id)
     try:
         await api_client.get_token(str(message.from_user.id))
-        result = await api_client.create_subscription()
-        await message.answer(
+        result = await api_client.create_subscription(
+            idempotency_key=f"tg:{message.chat.id}:{message.message_id}"
+        )
+        await outbound.answer(
+            message,
             f"Subscription created successfully!\n"
             f"Coins spent: {result['coins_spent']}\n"
             f"Remaining coins: {result['remaining_coins']}"
@@ -111,18 +247,18 @@ async def cmd_subscribe(message: Message):
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 400:
             error_data = e.response.json()
-            await message.answer(error_data["detail"])
+            await outbound.answer(message, error_data["detail"])
         else:
-            logger.error(f"Error in cmd_subscribe: {str(e)}", exc_info=True)
-            await message.answer("An error occurred while processing your subscription. Please try again later.")
+            logger.error("Error in cmd_subscribe: %s", e, exc_info=True)
+            await outbound.answer(message, "An error occurred while processing your subscription. Please try again later.")
     except Exception as e:
-        logger.error(f"Error in cmd_subscribe: {str(e)}", exc_info=True)
+        logger.error("Error in cmd_subscribe: %s", e, exc_info=True)
 
-        await message.answer("An error occurred while processing your subscription. Please try again later.")
+        await outbound.answer(message, "An error occurred while processing your subscription. Please try again later.")
 
 @dp.message(Command("wallet"))
 async def cmd_wallet(message: Message):
-    logger.info(f"Received /wallet command from user {message.from_user.id}")
+    logger.info("Received /wallet command from user %s", message.from_user.id)
     try:
         await api_client.get_token(str(message.from_user.id))
         wallet_info = await api_client.get_wallet()
@@ -132,22 +268,23 @@ async def cmd_wallet(message: Message):
             [InlineKeyboardButton(text="🕐 Subscribe", callback_data="subscribe")]
         ])
 
-        await message.answer(
+        await outbound.answer(
+            message,
             f"💰 Your Wallet Balance: {wallet_info['balance']} coins\n\n"
             f"💡 Each minute of subscription costs {wallet_info['subscription_cost_per_minute']} coins\n"
             f"🔄 Use the button below to add more coins!",
             reply_markup=keyboard
         )
     except httpx.HTTPStatusError as e:
-        logger.error(f"Error in cmd_wallet: {str(e)}", exc_info=True)
-        await message.answer("An error occurred while checking your wallet. Please try again later.")
+        logger.error("Error in cmd_wallet: %s", e, exc_info=True)
+        await outbound.answer(message, "An error occurred while checking your wallet. Please try again later.")
     except Exception as e:
-        logger.error(f"Error in cmd_wallet: {str(e)}", exc_info=True)
-        await message.answer("An error occurred while checking your wallet. Please try again later.")
+        logger.error("Error in cmd_wallet: %s", e, exc_info=True)
+        await outbound.answer(message, "An error occurred while checking your wallet. Please try again later.")
 
 @dp.message(Command("add_coins"))
 async def cmd_add_coins(message: Message):
-    logger.info(f"Received /add_coins command from user {message.from_user.id}")
+    logger.info("Received /add_coins command from user %s", message.from_user.id)
     try:
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="➕ Add 10 coins", callback_data="add_coins_10")],
@@ -156,30 +293,32 @@ async def cmd_add_coins(message: Message):
             [InlineKeyboardButton(text="➕ Add 100 coins", callback_data="add_coins_100")]
         ])
 
-        await message.answer(
+        await outbound.answer(
+            message,
             "💰 Add coins to your wallet\n\n"
             "Select the amount of coins you want to add:",
             reply_markup=keyboard
         )
     except Exception as e:
-        logger.error(f"Error in cmd_add_coins: {str(e)}", exc_info=True)
-        await message.answer("An error occurred while processing your request. Please try again later.")
+        logger.error("Error in cmd_add_coins: %s", e, exc_info=True)
+        await outbound.answer(message, "An error occurred while processing your request. Please try again later.")
 
 @dp.callback_query(lambda c: c.data.startswith('add_coins_'))
 async def process_add_coins(callback_query: CallbackQuery):
-    logger.info(f"Received add coins callback from user {callback_query.from_user.id}")
+    logger.info("Received add coins callback from user %s", callback_query.from_user.id)
     try:
         amount = int(callback_query.data.split('_')[-1])
         
         await api_client.get_token(str(callback_query.from_user.id))
-        result = await api_client.add_coins(amount)
+        result = await api_client.add_coins(amount, idempotency_key=f"tg-callback:{callback_query.id}")
 
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="➕ Add 10 coins", callback_data="add_coins_10")],
             [InlineKeyboardButton(text="🕐 Subscribe", callback_data="subscribe")]
         ])
 
-        await callback_query.message.edit_text(
+        await outbound.edit_text(
+            callback_query.message,
             f"💰 Your Wallet Balance: {result['new_balance']} coins\n\n"
             f"💡 Each minute of subscription costs 10 coins\n"
             f"🔄 Use the button below to add more coins!",
@@ -188,17 +327,18 @@ async def process_add_coins(callback_query: CallbackQuery):
         
         await callback_query.answer(f"✅ {amount} coins added to your wallet!")
     except Exception as e:
-        logger.error(f"Error in process_add_coins: {str(e)}", exc_info=True)
+        logger.error("Error in process_add_coins: %s", e, exc_info=True)
         await callback_query.answer("An error occurred while adding coins. Please try again later.")
 
 @dp.callback_query(lambda c: c.data == "subscribe")
 async def process_subscribe(callback_query: CallbackQuery):
-    logger.info(f"Received subscribe callback from user {callback_query.from_user.id}")
+    logger.info("Received subscribe callback from user %s", callback_query.from_user.id)
     try:
         await api_client.get_token(str(callback_query.from_user.id))
-        result = await api_client.create_subscription()
+        result = await api_client.create_subscription(idempotency_key=f"tg-callback:{callback_query.id}")
         
-        await callback_query.message.edit_text(
+        await outbound.edit_text(
+            callback_query.message,
             f"✅ Subscription created successfully!\n\n"
             f"💰 Coins spent: {result['coins_spent']}\n"
             f"💳 Remaining coins: {result['remaining_coins']}\n\n"
@@ -212,39 +352,147 @@ async def process_subscribe(callback_query: CallbackQuery):
             answer_data = error_data["detail"] + "\n\n" + "💰 You can add coins to your wallet using /add_coins command."
             await callback_query.answer(answer_data)
         else:
-            logger.error(f"Error in process_subscribe: {str(e)}", exc_info=True)
+            logger.error("Error in process_subscribe: %s", e, exc_info=True)
             await callback_query.answer("An error occurred while processing your subscription. Please try again later.")
     except Exception as e:
-        logger.error(f"Error in process_subscribe: {str(e)}", exc_info=True)
+        logger.error("Error in process_subscribe: %s", e, exc_info=True)
         await callback_query.answer("An error occurred while processing your subscription. Please try again later.")
 
 @dp.message()
 async def handle_message(message: Message):
-    logger.info(f"Received message from user {message.from_user.id}: {message.text[:50]}...")
+    logger.info("Received message from user %s", message.from_user.id)
+    logger.debug("Message text: %.50s...", message.text)
+    chat_dispatcher.submit(message)
+
+async def process_chat_messages(messages: List[Message]):
+    """Send a coalesced batch of messages from one chat to the LLM as a single prompt"""
+    message = messages[-1]
+    if len(messages) > 1:
+        logger.info("Coalesced %d messages from user %s", len(messages), message.from_user.id)
+    # Photos and documents contribute their caption, stickers and the like nothing
+    texts = [m.text or m.caption for m in messages if m.text or m.caption]
     try:
+        if not texts:
+            await outbound.answer(message, "Please send your request as a text message.")
+            return
+
         await api_client.get_token(str(message.from_user.id))
         
-        processing_msg = await message.answer("Processing your request...")
+        processing_msg = await outbound.answer(message, "Processing your request...")
         
-        result = await api_client.create_message(message.text)
-        logger.info(f"Result: {result}")
+        result = await api_client.create_message(
+            "\n".join(texts),
+            # Telegram redeliveries of the same messages map to the same key
+            idempotency_key=f"tg:{message.chat.id}:{messages[0].message_id}-{message.message_id}"
+        )
+        logger.debug("Result: %s", result)
         
-        await processing_msg.edit_text(result["response"])
+        await outbound.edit_text(processing_msg, result["response"])
         
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 403:
-            await message.answer("You need an active subscription to use the service. Use /subscribe to get access.")
+            await outbound.answer(message, "You need an active subscription to use the service. Use /subscribe to get access.")
+        elif e.response.status_code == 413:
+            await outbound.answer(message, "Your message is too long. Please shorten it and try again.")
         else:
-            logger.error(f"Error in handle_message: {str(e)}", exc_info=True)
-            await message.answer("An error occurred while processing your message. Please try again later.")
+            logger.error("Error in process_chat_messages: %s", e, exc_info=True)
+            await outbound.answer(message, "An error occurred while processing your message. Please try again later.")
     except Exception as e:
-        logger.error(f"Error in handle_message: {str(e)}", exc_info=True)
-        await message.answer("An error occurred while processing your message. Please try again later.")
+        logger.error("Error in process_chat_messages: %s", e, exc_info=True)
+        await outbound.answer(message, "An error occurred while processing your message. Please try again later.")
+
+chat_dispatcher = ChatDispatcher(
+    process_chat_messages,
+    debounce=settings.CHAT_DEBOUNCE_SECONDS,
+    supersede=settings.CHAT_SUPERSEDE_QUEUED
+)
+
+def create_webhook_app() -> web.Application:
+    """Build the aiohttp application that receives Telegram webhook updates"""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        # Answer only once the update is handled, so a failure returns an error
+        # and Telegram redelivers the update. Handlers return quickly since
+        # messages are queued per chat.
+        handle_in_background=False,
+        secret_token=settings.TELEGRAM_WEBHOOK_SECRET
+    ).register(app, path=settings.TELEGRAM_WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def register_webhook():
+    """Point Telegram at our webhook unless another replica already did"""
+    if not settings.TELEGRAM_WEBHOOK_URL:
+        logger.info("TELEGRAM_WEBHOOK_URL is not set, assuming the webhook is registered externally")
+        return
+
+    url = settings.TELEGRAM_WEBHOOK_URL.rstrip("/") + settings.TELEGRAM_WEBHOOK_PATH
+    webhook_info = await bot.get_webhook_info()
+    if webhook_info.url == url:
+        logger.info("Webhook already registered at %s", url)
+        return
+
+    await bot.set_webhook(
+        url,
+        secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info("Webhook registered at %s", url)
+
+async def drain_updates(shutdown: GracefulShutdown):
+    """Finish processing received updates and deliver the replies they queued"""
+    await chat_dispatcher.drain(shutdown)
+    await outbound.flush(shutdown.remaining)
+
+async def start_polling(shutdown: GracefulShutdown):
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    stop = asyncio.create_task(shutdown.wait())
+    try:
+        await asyncio.wait({polling, stop}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stop.cancel()
+    if not polling.done():
+        await dp.stop_polling()
+    await polling
+    await drain_updates(shutdown)
+
+async def start_webhook(shutdown: GracefulShutdown):
+    if not settings.TELEGRAM_WEBHOOK_SECRET:
+        raise RuntimeError("TELEGRAM_WEBHOOK_SECRET must be set in webhook mode")
+
+    runner = web.AppRunner(create_webhook_app())
+    await runner.setup()
+    site = web.TCPSite(runner, settings.TELEGRAM_WEBHOOK_HOST, settings.TELEGRAM_WEBHOOK_PORT)
+    await site.start()
+    logger.info("Listening for webhook updates on %s:%s", settings.TELEGRAM_WEBHOOK_HOST, settings.TELEGRAM_WEBHOOK_PORT)
+
+    try:
+        await register_webhook()
+        await shutdown.wait()
+        # Stop accepting updates, Telegram redelivers them to the other replicas
+        await site.stop()
+        await drain_updates(shutdown)
+    finally:
+        # Also closes the bot session, so only after the replies are delivered
+        await runner.cleanup()
 
 async def start_bot():
-    logger.info("Starting Telegram bot")
+    logger.info("Starting Telegram bot in %s mode", settings.BOT_MODE)
+    start_http_server(settings.BOT_METRICS_PORT)
+    loop_lag_monitor = start_loop_lag_monitor("bot")
+    shutdown = GracefulShutdown.from_settings("bot")
+    shutdown.install()
     try:
-        await dp.start_polling(bot)
+        if settings.BOT_MODE == "webhook":
+            await start_webhook(shutdown)
+        else:
+            await start_polling(shutdown)
     finally:
         await api_client.close()
-    logger.info("Telegram bot started successfully")
\ No newline at end of file
+        await message_broker.disconnect()
+        await bot.session.close()
+        if loop_lag_monitor:
+            await loop_lag_monitor.stop()
+    logger.info("Telegram bot stopped")
\ No newline at end of file
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.types import Message
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.message_broker import MessageBroker
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_QUEUE_LAG = Histogram(
+    "telegram_outbound_queue_lag_seconds",
+    "Time between queueing an outbound Telegram call and its successful delivery",
+    ["method"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+OUTBOUND_THROTTLED = Counter(
+    "telegram_outbound_throttled_total",
+    "Outbound Telegram calls delayed by rate limiting",
+    ["reason"],
+)
+OUTBOUND_MERGED_EDITS = Counter(
+    "telegram_outbound_merged_edits_total",
+    "Queued message edits replaced by a newer edit of the same message",
+)
+OUTBOUND_QUEUED = Gauge(
+    "telegram_outbound_queued",
+    "Outbound Telegram calls waiting to be delivered",
+)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> float:
+        """Take a token, or return how many seconds to wait until one is available"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+class SharedRateLimit:
+    """
+    Rate limit shared by every bot replica through Redis.
+
+    Calls are counted per one-second window in a Redis key, so all replicas draw
+    from the same `rate` per second. Without a broker, or while Redis cannot be
+    reached, each replica falls back to a token bucket of its own.
+    """
+
+    def __init__(self, rate: float, broker: Optional[MessageBroker] = None, key: str = "telegram_global_rate"):
+        self.rate = rate
+        self.broker = broker
+        self.key = key
+        self.local = TokenBucket(rate, rate)
+
+    async def try_acquire(self) -> float:
+        """Take a slot, or return how many seconds to wait until the next window"""
+        if self.broker is None:
+            return self.local.try_acquire()
+
+        now = time.time()
+        window = int(now)
+        try:
+            count = await self.broker.incr(f"{self.key}:{window}", expire=2)
+        except Exception as e:
+            logger.warning("Shared rate limit unavailable, limiting this replica only: %s", e)
+            return self.local.try_acquire()
+        if count <= self.rate:
+            return 0.0
+        return window + 1 - now
+
+class OutboundJob:
+    def __init__(self, method: str, call: Callable[..., Awaitable[Any]], kwargs: dict, edit_key: Optional[int] = None):
+        self.method = method
+        self.call = call
+        self.kwargs = kwargs
+        self.edit_key = edit_key
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.in_flight = False
+        self.futures: List[asyncio.Future] = [asyncio.get_running_loop().create_future()]
+
+    def resolve(self, result: Any = None, error: Optional[BaseException] = None):
+        for future in self.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+class OutboundSender:
+    """
+    Delivers outgoing Telegram calls within Telegram's flood limits.
+
+    Calls are queued per chat and sent in order, limited by a global rate shared
+    with the other bot replicas through `broker` and a per-chat token bucket
+    (stricter for groups). RetryAfter responses pause the chat
+    for the requested time, and a queued edit of a message is replaced by any newer
+    edit of the same message so only the latest text is sent.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        group_rate: float = 20 / 60,
+        max_retries: int = 5,
+        broker: Optional[MessageBroker] = None
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global_limit = SharedRateLimit(global_rate, broker, key=f"telegram_global_rate:{bot.id}")
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, Deque[OutboundJob]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    async def answer(self, message: Message, text: str, **kwargs) -> Message:
+        """Queued equivalent of `message.answer`"""
+        return await self.send_message(message.chat.id, text, **kwargs)
+
+    async def edit_text(self, message: Message, text: str, **kwargs) -> Any:
+        """Queued equivalent of `message.edit_text`"""
+        return await self.edit_message_text(message.chat.id, message.message_id, text, **kwargs)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> Message:
+        job = OutboundJob("send_message", self.bot.send_message, dict(chat_id=chat_id, text=text, **kwargs))
+        return await self._enqueue(chat_id, job)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs) -> Any:
+        queue = self._queues.get(chat_id, ())
+        for job in queue:
+            if job.edit_key == message_id and not job.in_flight:
+                job.kwargs = dict(chat_id=chat_id, message_id=message_id, text=text, **kwargs)
+                future = asyncio.get_running_loop().create_future()
+                job.futures.append(future)
+                OUTBOUND_MERGED_EDITS.inc()
+                return await future
+
+        job = OutboundJob(
+            "edit_message_text",
+            self.bot.edit_message_text,
+            dict(chat_id=chat_id, message_id=message_id, text=text, **kwargs),
+            edit_key=message_id
+        )
+        return await self._enqueue(chat_id, job)
+
+    async def flush(self, timeout: Optional[float] = None):
+        """Wait until every queued call has been delivered or has failed"""
+        workers = list(self._workers.values())
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+
+    async def _enqueue(self, chat_id: int, job: OutboundJob) -> Any:
+        self._queues.setdefault(chat_id, deque()).append(job)
+        OUTBOUND_QUEUED.inc()
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._run(chat_id))
+        return await job.futures[0]
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Idle chats have full buckets, forgetting them does not loosen the limit
+                self._chat_buckets = {k: v for k, v in self._chat_buckets.items() if not v.is_full()}
+            # Group and channel ids are negative
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_rate * 60)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id: int):
+        bucket = self._chat_bucket(chat_id)
+        wait = bucket.try_acquire()
+        while wait > 0:
+            OUTBOUND_THROTTLED.labels(reason="chat_limit").inc()
+            await asyncio.sleep(wait)
+            wait = bucket.try_acquire()
+
+        wait = await self._global_limit.try_acquire()
+        while wait > 0:
+            OUTBOUND_THROTTLED.labels(reason="global_limit").inc()
+            await asyncio.sleep(wait)
+            wait = await self._global_limit.try_acquire()
+
+    async def _run(self, chat_id: int):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                job = queue[0]
+                await self._acquire(chat_id)
+
+                job.in_flight = True
+                job.attempts += 1
+                try:
+                    result = await job.call(**job.kwargs)
+                except TelegramRetryAfter as e:
+                    job.in_flight = False
+                    OUTBOUND_THROTTLED.labels(reason="retry_after").inc()
+                    if job.attempts > self.max_retries:
+                        self._finish(queue, error=e)
+                        continue
+                    logger.warning("Telegram flood control in chat %s, retrying in %ss", chat_id, e.retry_after)
+                    await asyncio.sleep(e.retry_after)
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    job.in_flight = False
+                    if job.attempts > self.max_retries:
+                        self._finish(queue, error=e)
+                        continue
+                    delay = min(2 ** job.attempts, 30) * random.uniform(0.5, 1.5)
+                    logger.warning("Telegram %s failed in chat %s: %s, retrying in %.1fs", job.method, chat_id, e, delay)
+                    await asyncio.sleep(delay)
+                except Exception as e:
+                    self._finish(queue, error=e)
+                else:
+                    OUTBOUND_QUEUE_LAG.labels(method=job.method).observe(time.monotonic() - job.enqueued_at)
+                    self._finish(queue, result=result)
+        finally:
+            for job in queue:
+                job.resolve(error=RuntimeError("Outbound sender stopped"))
+            OUTBOUND_QUEUED.dec(len(queue))
+            self._queues.pop(chat_id, None)
+            self._workers.pop(chat_id, None)
+
+    def _finish(self, queue: Deque[OutboundJob], result: Any = None, error: Optional[BaseException] = None):
+        job = queue.popleft()
+        OUTBOUND_QUEUED.dec()
+        job.resolve(result, error)
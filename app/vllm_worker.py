@@ -1,35 +1,151 @@
 import asyncio
 import logging
+import time
+from typing import Any, Dict
+from prometheus_client import start_http_server
 from app.core.config import settings
+from app.core.instrumentation import start_loop_lag_monitor
+from app.core.shutdown import GracefulShutdown
+from app.core.startup import StartupTracker, warm_up_vllm
 from app.message_broker import MessageBroker
-from app.tasks.process_llm import process_vllm_response
+from app.tasks.process_llm import close_vllm_clients, process_vllm_response, retry_queue, router, usage_meter
+from app.tasks.process_llm import message_broker as response_broker
+from app.tasks.tokens import load_tokenizer
 
 logger = logging.getLogger(__name__)
 
+startup = StartupTracker("worker")
+shutdown = GracefulShutdown.from_settings("worker")
+
+# Jobs run concurrently, the adaptive limiter decides how many reach vLLM at once.
+# The job arguments are kept so that unfinished jobs can be handed back on shutdown
+running_jobs: Dict[asyncio.Task, Dict[str, Any]] = {}
+
+def start_job(**job) -> asyncio.Task:
+    task = asyncio.create_task(process_vllm_response(**job))
+    running_jobs[task] = job
+    task.add_done_callback(lambda done: running_jobs.pop(done, None))
+    return task
+
+async def requeue_unfinished(tasks):
+    """Cancel jobs that missed the drain timeout and put them back on the retry queue"""
+    jobs = [running_jobs[task] for task in tasks if task in running_jobs]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    for job in jobs:
+        # Interrupted attempts do not count against the job's retry budget
+        job.setdefault("attempt", 1)
+        job["deadline"] = job.get("deadline") or time.time() + settings.LLM_REQUEST_DEADLINE
+        try:
+            await retry_queue.requeue(job)
+            logger.info("Re-queued unfinished message_id %s", job["message_id"])
+        except Exception as e:
+            logger.error("Error re-queueing message_id %s: %s", job["message_id"], e, exc_info=True)
+
+async def process_retries():
+    """Run retries whose backoff delay has elapsed"""
+    while not shutdown.stopping.is_set():
+        try:
+            for job in await retry_queue.pop_due():
+                logger.info("Retrying message_id %s, attempt %s", job["message_id"], job["attempt"])
+                start_job(**job)
+        except Exception as e:
+            logger.error("Error processing VLLM retries: %s", e, exc_info=True)
+        await asyncio.sleep(settings.LLM_RETRY_POLL_INTERVAL)
+
+async def flush_usage():
+    try:
+        flushed = await usage_meter.flush()
+        if flushed:
+            logger.info("Rolled up %d usage counters", flushed)
+    except Exception as e:
+        logger.error("Error flushing token usage: %s", e, exc_info=True)
+
+async def process_usage_flush():
+    """Periodically roll the Redis usage counters up into the usage table"""
+    while not shutdown.stopping.is_set():
+        try:
+            await asyncio.wait_for(shutdown.wait(), settings.USAGE_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        await flush_usage()
+
 async def process_vllm_requests():
     """Process VLLM requests from the message broker"""
-    message_broker = MessageBroker(redis_url=settings.REDIS_URL)
-    await message_broker.connect()
-    
-    pubsub = await message_broker.subscribe("vllm_requests")
-    
+    start_http_server(settings.WORKER_METRICS_PORT)
+    loop_lag_monitor = start_loop_lag_monitor("worker")
+    shutdown.install()
+
+    message_broker = MessageBroker.from_settings(name="worker")
+    async with startup.phase("broker"):
+        await message_broker.warm_up()
+        await response_broker.warm_up(settings.BROKER_WARMUP_CONNECTIONS)
+
+    async with startup.phase("tokenizer"):
+        await asyncio.to_thread(load_tokenizer)
+
+    if settings.VLLM_WARMUP_PROMPT:
+        async with startup.phase("vllm_warmup"):
+            await asyncio.gather(*(
+                warm_up_vllm(
+                    route.base_url,
+                    route.model,
+                    settings.VLLM_WARMUP_PROMPT,
+                    timeout=settings.VLLM_WARMUP_TIMEOUT
+                )
+                for route in router.backends()
+            ))
+
+    # Subscribed only now, requests published during the warm-up go to workers that are ready
+    async with startup.phase("subscribe"):
+        pubsub = await message_broker.subscribe("vllm_requests")
+
+    retry_task = asyncio.create_task(process_retries())
+    usage_task = asyncio.create_task(process_usage_flush())
+    startup.mark_ready()
     logger.info("VLLM worker started and listening for requests")
     
-    while True:
+    while not shutdown.stopping.is_set():
         try:
-            message = await message_broker.get_message(pubsub)
+            message = await message_broker.get_message(pubsub, timeout=1.0)
             if message:
-                logger.info(f"Received VLLM request for message_id: {message['message_id']}")
+                logger.info("Received VLLM request for message_id: %s", message["message_id"])
                 
-                await process_vllm_response(
+                start_job(
                     message_id=message["message_id"],
-                    content=message["content"]
+                    content=message["content"],
+                    messages=message.get("messages"),
+                    deadline=message.get("deadline"),
+                    role=message.get("role"),
+                    user_id=message.get("user_id")
                 )
                 
         except Exception as e:
-            logger.error(f"Error processing VLLM request: {str(e)}", exc_info=True)
+            logger.error("Error processing VLLM request: %s", e, exc_info=True)
             await asyncio.sleep(1)
 
+    # Stop taking new requests, other workers keep receiving them
+    await pubsub.unsubscribe()
+    await pubsub.aclose()
+    startup.mark_not_ready()
+    await retry_task
+
+    unfinished = await shutdown.drain(running_jobs, "jobs")
+    if unfinished:
+        await requeue_unfinished(unfinished)
+    # Picks up the counters of the jobs that finished while draining
+    await usage_task
+    await flush_usage()
+
+    await close_vllm_clients()
+    await message_broker.disconnect()
+    await response_broker.disconnect()
+    if loop_lag_monitor:
+        await loop_lag_monitor.stop()
+    logger.info("VLLM worker stopped")
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     asyncio.run(process_vllm_requests()) 
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+Benchmarks for the API's database hot paths.
+
+    pip install -r benchmarks/requirements.txt
+    pytest benchmarks --bench-scale 0.001
+
+The database is seeded once per scale (see seed.py) and reused by later runs.
+BENCH_DATABASE_URL points the suite at another database, e.g. a local Postgres;
+Redis is replaced with fakeredis unless BENCH_REDIS_URL is set. Query counts are
+compared with baselines.json. Median latencies depend on the machine, so they are
+recorded in the untracked latency_baselines.json and only compared with
+`--check-latency`. `--update-baselines` records the current values of both.
+"""
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+from benchmarks.helpers import Baselines, QueryCounter
+
+BASELINES_PATH = Path(__file__).parent / "baselines.json"
+LATENCY_BASELINES_PATH = Path(__file__).parent / "latency_baselines.json"
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption("--bench-scale", type=float, default=0.001, help="fraction of 100k users / 10M messages to seed")
+    group.addoption("--bench-iterations", type=int, default=50, help="timed calls per endpoint")
+    group.addoption("--bench-latency-tolerance", type=float, default=1.5, help="allowed slowdown against the baseline")
+    group.addoption("--check-latency", action="store_true", help="fail on latencies over this machine's baselines")
+    group.addoption("--update-baselines", action="store_true", help="record the measured values as the new baselines")
+
+def pytest_configure(config):
+    # Settings are read on import, so the environment has to be ready before the app is imported
+    scale = config.getoption("--bench-scale")
+    default_url = f"sqlite:///{tempfile.gettempdir()}/llm_service_bench_{scale}.db"
+    os.environ["DATABASE_URL"] = os.environ.get("BENCH_DATABASE_URL", default_url)
+    os.environ.pop("DATABASE_READ_URL", None)
+    for name, value in {
+        "POSTGRES_USER": "bench",
+        "POSTGRES_PASSWORD": "bench",
+        "POSTGRES_DB": "bench",
+        "REDIS_URL": os.environ.get("BENCH_REDIS_URL", "redis://localhost:6379/15"),
+        "JWT_SECRET_KEY": "bench",
+        "TELEGRAM_BOT_TOKEN": "123456:bench",
+        "VLLM_API_URL": "http://localhost:8001/v1",
+        "API_URL": "http://localhost:8000",
+        "LOGS_DIR": tempfile.gettempdir(),
+        "LOG_FORMAT": "text",
+    }.items():
+        os.environ.setdefault(name, value)
+
+@pytest.fixture(scope="session")
+def bench_scale(request) -> float:
+    return request.config.getoption("--bench-scale")
+
+@pytest.fixture(scope="session")
+def bench_iterations(request) -> int:
+    return request.config.getoption("--bench-iterations")
+
+@pytest.fixture(scope="session")
+def seeded_engine(bench_scale):
+    from app.db.session import engine
+    from benchmarks.seed import is_seeded, seed
+
+    if not is_seeded(engine, bench_scale):
+        started_at = time.perf_counter()
+        seed(engine, bench_scale)
+        print(f"\nSeeded benchmark database at scale {bench_scale} in {time.perf_counter() - started_at:.1f}s")
+    return engine
+
+@pytest.fixture(scope="session")
+def client(seeded_engine):
+    from fastapi.testclient import TestClient
+    import app.main as main
+
+    if "BENCH_REDIS_URL" not in os.environ:
+        import fakeredis
+        main.message_broker.redis = fakeredis.FakeAsyncRedis()
+
+    async def process_llm_request_stub(message_id: int) -> None:
+        # Only the API's own database work is measured, not the LLM round trip
+        return None
+
+    main.process_llm_request = process_llm_request_stub
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture(scope="session")
+def baselines(request, seeded_engine, bench_scale):
+    recorder = Baselines(
+        BASELINES_PATH,
+        LATENCY_BASELINES_PATH,
+        bench_scale,
+        seeded_engine.dialect.name,
+        request.config.getoption("--bench-latency-tolerance"),
+        request.config.getoption("--update-baselines"),
+        request.config.getoption("--check-latency"),
+    )
+    yield recorder
+    recorder.save()
+
+@pytest.fixture
+def query_counter(seeded_engine):
+    return QueryCounter(seeded_engine)
@@ -0,0 +1,107 @@
+"""Query counting, timing and baseline checks shared by the benchmarks"""
+import json
+import statistics
+import time
+import warnings
+from pathlib import Path
+
+from sqlalchemy import event
+
+class QueryCounter:
+    """Counts SQL statements sent through an engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+def _load_json(path: Path) -> dict:
+    return json.loads(path.read_text()) if path.exists() else {}
+
+def _save_json(path: Path, data: dict):
+    path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n")
+
+class Baselines:
+    """
+    Recorded query counts (per endpoint) and median latencies (per database and scale).
+
+    Query counts do not depend on the machine, so they are kept in the repository and
+    always checked. Latencies only compare with runs on the same machine, so they are
+    kept in a local file and checked only when `check_latency` is set.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        latency_path: Path,
+        scale: float,
+        dialect: str,
+        tolerance: float,
+        update: bool,
+        check_latency: bool
+    ):
+        self.path = path
+        self.latency_path = latency_path
+        self.latency_key = f"{dialect}@{scale}"
+        self.tolerance = tolerance
+        self.update = update
+        self.check_latency = check_latency
+        self.queries = _load_json(path).get("queries", {})
+        self.latencies = _load_json(latency_path)
+
+    def check(self, name: str, queries: int, latencies: list):
+        median_ms = statistics.median(latencies) * 1000
+        print(f"\n{name}: {queries} queries, median {median_ms:.2f}ms")
+        latency_baselines = self.latencies.setdefault(self.latency_key, {})
+        if self.update:
+            self.queries[name] = queries
+            latency_baselines[name] = round(median_ms, 3)
+            return
+
+        expected_queries = self.queries.get(name)
+        assert expected_queries is not None, f"No query count baseline for {name}, run with --update-baselines"
+        assert queries <= expected_queries, f"{name} ran {queries} queries, baseline is {expected_queries}"
+
+        if not self.check_latency:
+            return
+        expected_ms = latency_baselines.get(name)
+        if expected_ms is None:
+            warnings.warn(f"No latency baseline for {name} on {self.latency_key} in {self.latency_path}")
+            return
+        assert median_ms <= expected_ms * self.tolerance, (
+            f"{name} median latency {median_ms:.2f}ms exceeds baseline {expected_ms:.2f}ms x {self.tolerance}"
+        )
+
+    def save(self):
+        if self.update:
+            _save_json(self.path, {"queries": self.queries})
+            _save_json(self.latency_path, self.latencies)
+
+def auth_headers(telegram_id: str) -> dict:
+    from app.main import create_access_token
+    return {"Authorization": f"Bearer {create_access_token({'sub': telegram_id})}"}
+
+def measure(call, iterations: int, query_counter: QueryCounter):
+    """Run call once under the query counter, then time it; returns (queries, latencies)"""
+    with query_counter:
+        call(0)
+    latencies = []
+    for i in range(1, iterations + 1):
+        started_at = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - started_at)
+    return query_counter.count, latencies
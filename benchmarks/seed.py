@@ -0,0 +1,124 @@
+"""
+Seed a database with realistic data volumes for the benchmarks.
+
+At scale 1.0 this creates 100k users and 10M messages, smaller scales shrink both
+proportionally. Run it on its own to prepare a large database once:
+
+    python -m benchmarks.seed --scale 0.1
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Engine
+
+from app.models import models
+from app.models.base import Base
+
+FULL_SCALE_USERS = 100_000
+FULL_SCALE_MESSAGES = 10_000_000
+BATCH_SIZE = 10_000
+ADMIN_TELEGRAM_ID = "bench-admin"
+
+WORDS = (
+    "model token prompt answer latency python redis queue cache summary vector request "
+    "subscription wallet history context budget batch stream worker retry deploy"
+).split()
+
+def _text(rng: random.Random, min_words: int, max_words: int) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(min_words, max_words)))
+
+def counts_for_scale(scale: float):
+    return max(int(FULL_SCALE_USERS * scale), 10), max(int(FULL_SCALE_MESSAGES * scale), 100)
+
+def is_seeded(engine: Engine, scale: float) -> bool:
+    users, messages = counts_for_scale(scale)
+    with engine.connect() as connection:
+        try:
+            seeded_users = connection.execute(select(func.count()).select_from(models.User.__table__)).scalar()
+            seeded_messages = connection.execute(select(func.count()).select_from(models.Message.__table__)).scalar()
+        except Exception:
+            return False
+    # Benchmarks add rows of their own, so only require at least the seeded volume
+    return seeded_users >= users + 1 and seeded_messages >= messages
+
+def seed(engine: Engine, scale: float, seed_value: int = 42):
+    """Recreate all tables and fill them for the given scale"""
+    users, messages = counts_for_scale(scale)
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        rows = [
+            {
+                "telegram_id": str(1_000_000 + i),
+                "role": models.UserRole.USER,
+                "wallet": 1_000_000,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(users)
+        ]
+        rows.append({
+            "telegram_id": ADMIN_TELEGRAM_ID,
+            "role": models.UserRole.ADMIN,
+            "wallet": 20,
+            "created_at": now,
+            "updated_at": now,
+        })
+        for start in range(0, len(rows), BATCH_SIZE):
+            connection.execute(insert(models.User.__table__), rows[start:start + BATCH_SIZE])
+
+        # Expired subscriptions for every user, so the active subscription lookup
+        # has history to skip over
+        subscriptions = []
+        transactions = []
+        for user_id in range(1, users + 1):
+            for n in range(rng.randint(1, 3)):
+                start_date = now - timedelta(days=rng.randint(2, 90), minutes=n)
+                subscriptions.append({
+                    "user_id": user_id,
+                    "start_date": start_date,
+                    "end_date": start_date + timedelta(minutes=1),
+                    "created_at": start_date,
+                    "updated_at": start_date,
+                })
+                transactions.append({
+                    "user_id": user_id,
+                    "amount": 5,
+                    "type": models.TransactionType.SUBSCRIPTION,
+                    "created_at": start_date,
+                    "updated_at": start_date,
+                })
+        for start in range(0, len(subscriptions), BATCH_SIZE):
+            connection.execute(insert(models.Subscription.__table__), subscriptions[start:start + BATCH_SIZE])
+            connection.execute(insert(models.Transaction.__table__), transactions[start:start + BATCH_SIZE])
+
+        batch = []
+        for n in range(messages):
+            created_at = now - timedelta(seconds=messages - n)
+            batch.append({
+                "user_id": rng.randint(1, users),
+                "content": _text(rng, 5, 40),
+                "response": _text(rng, 20, 150),
+                "created_at": created_at,
+                "updated_at": created_at,
+            })
+            if len(batch) >= BATCH_SIZE:
+                connection.execute(insert(models.Message.__table__), batch)
+                batch = []
+        if batch:
+            connection.execute(insert(models.Message.__table__), batch)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=float, default=0.01, help="fraction of 100k users / 10M messages")
+    args = parser.parse_args()
+
+    from app.db.session import engine
+    seed(engine, args.scale)
+    print(f"Seeded {engine.url.render_as_string(hide_password=True)} at scale {args.scale}")
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.helpers import auth_headers, measure
+from benchmarks.seed import counts_for_scale
+
+@pytest.fixture(scope="session")
+def subscribed_user(seeded_engine):
+    """A seeded user with a long active subscription"""
+    from sqlalchemy.orm import Session
+    from app.models import models
+
+    with Session(seeded_engine) as db:
+        user = db.query(models.User).filter(models.User.telegram_id == "1000000").one()
+        now = datetime.utcnow()
+        db.add(models.Subscription(user_id=user.id, start_date=now, end_date=now + timedelta(days=1)))
+        db.commit()
+        return user.telegram_id
+
+@pytest.fixture
+def unsubscribed_telegram_ids(seeded_engine, bench_scale, bench_iterations):
+    """Seeded users at the end of the range, with subscriptions from earlier runs removed"""
+    from sqlalchemy.orm import Session
+    from app.models import models
+
+    users, _ = counts_for_scale(bench_scale)
+    telegram_ids = [str(1_000_000 + users - 1 - i) for i in range(bench_iterations + 1)]
+    with Session(seeded_engine) as db:
+        user_ids = db.query(models.User.id).filter(models.User.telegram_id.in_(telegram_ids))
+        db.query(models.Subscription).filter(
+            models.Subscription.user_id.in_(user_ids),
+            models.Subscription.end_date > datetime.utcnow() - timedelta(days=1)
+        ).delete(synchronize_session=False)
+        db.commit()
+    return telegram_ids
+
+def test_get_current_user(client, query_counter, baselines, bench_iterations):
+    headers = auth_headers("1000001")
+
+    def call(i):
+        # /wallet does nothing but authenticate the user
+        response = client.get("/wallet", headers=headers)
+        assert response.status_code == 200
+
+    baselines.check("get_current_user", *measure(call, bench_iterations, query_counter))
+
+def test_get_user_info(client, query_counter, baselines, bench_iterations):
+    headers = auth_headers("1000001")
+
+    def call(i):
+        response = client.get("/me", headers=headers)
+        assert response.status_code == 200
+
+    baselines.check("get_user_info", *measure(call, bench_iterations, query_counter))
+
+def test_get_message_history(client, query_counter, baselines, bench_iterations):
+    headers = auth_headers("1000002")
+
+    def call(i):
+        response = client.get("/history", headers=headers)
+        assert response.status_code == 200
+
+    baselines.check("get_message_history", *measure(call, bench_iterations, query_counter))
+
+def test_create_subscription(client, query_counter, baselines, bench_iterations, unsubscribed_telegram_ids):
+    def call(i):
+        # A different user every time, since a user with an active subscription is rejected
+        response = client.post("/subscribe", headers=auth_headers(unsubscribed_telegram_ids[i]))
+        assert response.status_code == 200
+
+    baselines.check("create_subscription", *measure(call, bench_iterations, query_counter))
+
+def test_create_message(client, query_counter, baselines, bench_iterations, subscribed_user):
+    headers = auth_headers(subscribed_user)
+
+    def call(i):
+        response = client.post("/message", json={"content": f"benchmark question {i}"}, headers=headers)
+        assert response.status_code == 200
+
+    baselines.check("create_message", *measure(call, bench_iterations, query_counter))
@@ -0,0 +1,89 @@
+import statistics
+import time
+
+from benchmarks.helpers import auth_headers, measure
+from benchmarks.seed import ADMIN_TELEGRAM_ID
+
+def _median_ms(func, iterations: int) -> float:
+    latencies = []
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started_at)
+    return statistics.median(latencies) * 1000
+
+def _compare(name, engine, orm_query, schema, statement, iterations):
+    """Time the previous ORM + Pydantic encoding against the column-only orjson paths"""
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from sqlalchemy.orm import Session
+    from app.core.responses import fetch_json_rows
+
+    # A fresh session per call, like a request, so the ORM path gets no help from the identity map
+    def orm_path():
+        with Session(engine) as db:
+            return JSONResponse(jsonable_encoder([schema.model_validate(row) for row in orm_query(db).all()])).body
+
+    def orjson_path():
+        return fetch_json_rows(lambda: Session(engine), statement, stream_threshold=10 ** 9, chunk_size=1000)
+
+    def streamed_path():
+        return b"".join(fetch_json_rows(lambda: Session(engine), statement, stream_threshold=0, chunk_size=1000))
+
+    assert orjson.loads(orjson_path()) == orjson.loads(orm_path()) == orjson.loads(streamed_path())
+
+    orm_ms = _median_ms(orm_path, iterations)
+    orjson_ms = _median_ms(orjson_path, iterations)
+    streamed_ms = _median_ms(streamed_path, iterations)
+    print(
+        f"\n{name}: ORM + Pydantic {orm_ms:.2f}ms, columns + orjson {orjson_ms:.2f}ms "
+        f"({orm_ms / orjson_ms:.1f}x), streamed {streamed_ms:.2f}ms ({orm_ms / streamed_ms:.1f}x)"
+    )
+    assert orjson_ms < orm_ms
+
+def test_list_users_serialization(seeded_engine, bench_iterations):
+    from sqlalchemy import select
+    from app.main import USER_COLUMNS
+    from app.models import models
+    from app.schemas import user
+
+    _compare(
+        "list_users",
+        seeded_engine,
+        lambda db: db.query(models.User).order_by(models.User.id),
+        user.User,
+        select(*USER_COLUMNS).order_by(models.User.id),
+        max(bench_iterations // 5, 3)
+    )
+
+def test_message_history_serialization(seeded_engine, bench_iterations):
+    from sqlalchemy import func, select
+    from app.main import MESSAGE_COLUMNS
+    from app.models import models
+    from app.schemas import message
+
+    # The user with the longest history
+    with seeded_engine.connect() as connection:
+        user_id = connection.execute(
+            select(models.Message.user_id).group_by(models.Message.user_id).order_by(func.count().desc()).limit(1)
+        ).scalar()
+    _compare(
+        "message_history",
+        seeded_engine,
+        lambda db: db.query(models.Message).filter(
+            models.Message.user_id == user_id
+        ).order_by(models.Message.created_at.desc()),
+        message.Message,
+        select(*MESSAGE_COLUMNS).where(models.Message.user_id == user_id).order_by(models.Message.created_at.desc()),
+        bench_iterations
+    )
+
+def test_list_users(client, query_counter, baselines, bench_iterations):
+    headers = auth_headers(ADMIN_TELEGRAM_ID)
+
+    def call(i):
+        response = client.get("/admin/users", headers=headers)
+        assert response.status_code == 200
+
+    baselines.check("list_users", *measure(call, bench_iterations, query_counter))
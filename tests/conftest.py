@@ -0,0 +1,31 @@
+"""
+Tests for the Telegram bot's webhook mode.
+
+    pip install -r tests/requirements.txt
+    pytest tests
+
+Updates are delivered with the fake sender in app/fake_telegram.py to a webhook
+app served on a local port; Redis is replaced with fakeredis.
+"""
+import os
+import tempfile
+
+WEBHOOK_SECRET = "test-secret"
+
+def pytest_configure(config):
+    # Settings are read on import, so the environment has to be ready before the app is imported
+    for name, value in {
+        "DATABASE_URL": f"sqlite:///{tempfile.gettempdir()}/llm_service_tests.db",
+        "POSTGRES_USER": "test",
+        "POSTGRES_PASSWORD": "test",
+        "POSTGRES_DB": "test",
+        "REDIS_URL": "redis://localhost:6379/15",
+        "JWT_SECRET_KEY": "test",
+        "TELEGRAM_BOT_TOKEN": "123456:test",
+        "TELEGRAM_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "VLLM_API_URL": "http://localhost:8001/v1",
+        "API_URL": "http://localhost:8000",
+        "LOGS_DIR": tempfile.gettempdir(),
+        "LOG_FORMAT": "text",
+    }.items():
+        os.environ.setdefault(name, value)
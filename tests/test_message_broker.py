@@ -0,0 +1,49 @@
+"""Tests for the broker's shared response listener, run against fakeredis."""
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.broker_codecs import PayloadSerializer
+from app.message_broker import MessageBroker
+
+@pytest.fixture
+def broker():
+    broker = MessageBroker(serializer=PayloadSerializer(codec="json"))
+    broker.redis = fakeredis.FakeAsyncRedis()
+    return broker
+
+async def _reply(broker: MessageBroker, listener, channel: str, payload: dict):
+    async with listener.expect(channel) as queue:
+        await broker.publish(channel, payload)
+        return await asyncio.wait_for(queue.get(), timeout=5)
+
+def test_undecodable_payload_does_not_stop_listener(broker):
+    async def scenario():
+        listener = broker.listener("vllm_response_*")
+        try:
+            async with listener.expect("vllm_response_1") as queue:
+                # An envelope version this release does not know
+                await broker.redis.publish("vllm_response_1", b"\x00\x02\x00\x00junk")
+                await broker.publish("vllm_response_1", {"content": "first"})
+                first = await asyncio.wait_for(queue.get(), timeout=5)
+            second = await _reply(broker, listener, "vllm_response_2", {"content": "second"})
+            return first, second, listener.running
+        finally:
+            await listener.stop()
+
+    assert asyncio.run(scenario()) == ({"content": "first"}, {"content": "second"}, True)
+
+def test_listener_restarts_after_its_task_died(broker):
+    async def scenario():
+        listener = broker.listener("vllm_response_*")
+        try:
+            await listener.start()
+            listener._task.cancel()
+            await asyncio.wait([listener._task])
+            assert not listener.running
+            return await _reply(broker, listener, "vllm_response_1", {"content": "again"}), listener.running
+        finally:
+            await listener.stop()
+
+    assert asyncio.run(scenario()) == ({"content": "again"}, True)
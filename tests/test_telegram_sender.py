@@ -0,0 +1,39 @@
+"""Tests for the outbound Telegram sender's rate limits, run against fakeredis."""
+import asyncio
+import time
+
+import fakeredis
+
+from app.broker_codecs import PayloadSerializer
+from app.message_broker import MessageBroker
+from app.telegram_sender import OutboundSender
+
+class FakeBot:
+    id = 123456
+
+    def __init__(self):
+        self.sent_at = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent_at.append(time.monotonic())
+
+def test_global_rate_is_shared_between_replicas():
+    broker = MessageBroker(serializer=PayloadSerializer(codec="json"))
+    broker.redis = fakeredis.FakeAsyncRedis()
+    bot = FakeBot()
+    replicas = [OutboundSender(bot, global_rate=4, broker=broker) for _ in range(2)]
+
+    async def scenario():
+        started_at = time.monotonic()
+        # Distinct chats, so only the global limit applies
+        await asyncio.gather(*(
+            replica.send_message(chat_id, "hi")
+            for chat_id, replica in enumerate([*replicas] * 6, start=1)
+        ))
+        return [sent_at - started_at for sent_at in bot.sent_at]
+
+    offsets = asyncio.run(scenario())
+    assert len(offsets) == 12
+    # 12 sends at 4 per second across both replicas need at least two more windows
+    assert sorted(offsets)[-1] >= 1.0
+    assert sum(offset < 1.0 for offset in offsets) <= 8
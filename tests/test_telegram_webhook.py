@@ -0,0 +1,83 @@
+import asyncio
+import socket
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app.fake_telegram import build_update, send_updates
+from tests.conftest import WEBHOOK_SECRET
+
+class RecordingDispatcher:
+    """Stands in for the bot's ChatDispatcher, failing the first `failures` submits"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.texts = []
+
+    def submit(self, message):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("handler failed")
+        self.texts.append(message.text)
+
+@pytest.fixture
+def telegram_bot(monkeypatch):
+    import fakeredis
+    from app import telegram_bot
+
+    monkeypatch.setattr(telegram_bot.message_broker, "redis", fakeredis.FakeAsyncRedis())
+    return telegram_bot
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@asynccontextmanager
+async def webhook_server(telegram_bot):
+    """Serve the bot's webhook app on a local port, yields its URL"""
+    from aiohttp import web
+
+    runner = web.AppRunner(telegram_bot.create_webhook_app())
+    await runner.setup()
+    port = _free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    try:
+        yield f"http://127.0.0.1:{port}{telegram_bot.settings.TELEGRAM_WEBHOOK_PATH}"
+    finally:
+        await runner.cleanup()
+
+def test_redelivered_updates_are_handled_once(telegram_bot, monkeypatch):
+    dispatcher = RecordingDispatcher()
+    monkeypatch.setattr(telegram_bot, "chat_dispatcher", dispatcher)
+
+    async def scenario():
+        async with webhook_server(telegram_bot) as url:
+            updates = [build_update(1, 10, "first"), build_update(2, 10, "second")]
+            return await send_updates(url, updates, secret=WEBHOOK_SECRET, repeat=3)
+
+    assert asyncio.run(scenario()) == [200] * 6
+    assert dispatcher.texts == ["first", "second"]
+
+def test_updates_with_a_wrong_secret_are_rejected(telegram_bot, monkeypatch):
+    dispatcher = RecordingDispatcher()
+    monkeypatch.setattr(telegram_bot, "chat_dispatcher", dispatcher)
+
+    async def scenario():
+        async with webhook_server(telegram_bot) as url:
+            return await send_updates(url, [build_update(3, 10, "hello")], secret="wrong")
+
+    assert asyncio.run(scenario()) == [401]
+    assert dispatcher.texts == []
+
+def test_failed_update_is_processed_on_redelivery(telegram_bot, monkeypatch):
+    dispatcher = RecordingDispatcher(failures=1)
+    monkeypatch.setattr(telegram_bot, "chat_dispatcher", dispatcher)
+
+    async def scenario():
+        async with webhook_server(telegram_bot) as url:
+            return await send_updates(url, [build_update(4, 10, "retried")], secret=WEBHOOK_SECRET, repeat=2)
+
+    # The failure is reported to Telegram, which redelivers the update
+    assert asyncio.run(scenario()) == [500, 200]
+    assert dispatcher.texts == ["retried"]